@@ -0,0 +1,174 @@
+import os
+import re
+import hmac
+import json
+import time
+import base64
+import hashlib
+import secrets
+import threading
+from functools import lru_cache
+
+import requests
+from google.auth import jwt
+from google_auth_oauthlib.flow import Flow
+from db import execute_query, fetch_one
+
+SCOPES = ["openid", "https://www.googleapis.com/auth/userinfo.email", "https://www.googleapis.com/auth/userinfo.profile"]
+REDIRECT_URI = os.getenv("GOOGLE_REDIRECT_URI", "https://lehem-hakfar-orders-c410830785c4.herokuapp.com")
+
+# Where Google publishes the certificates that sign its ID tokens; overridable for offline testing
+GOOGLE_CERTS_URL = os.getenv("GOOGLE_CERTS_URL", "https://www.googleapis.com/oauth2/v1/certs")
+GOOGLE_ISSUERS = ("accounts.google.com", "https://accounts.google.com")
+# A token signed by an unknown key refetches the certificates, but not more often than this
+CERTS_MIN_REFRESH = 60
+
+# A session cookie lets a reload skip the OAuth round trip
+SESSION_COOKIE = "lh_session"
+SESSION_TTL = int(os.getenv("SESSION_TTL", str(12 * 3600)))
+
+CREATE_SESSION_QUERY = """
+INSERT INTO app_sessions (id_hash, name, email, expires_at)
+VALUES (%s, %s, %s, now() + make_interval(secs => %s));
+"""
+LOAD_SESSION_QUERY = "SELECT name, email FROM app_sessions WHERE id_hash = %s AND expires_at > now();"
+END_SESSION_QUERY = "DELETE FROM app_sessions WHERE id_hash = %s;"
+PURGE_SESSIONS_QUERY = "DELETE FROM app_sessions WHERE expires_at <= now();"
+
+_MAX_AGE = re.compile(r"max-age=(\d+)")
+
+
+@lru_cache(maxsize=1)
+def client_config():
+    """The OAuth client config from GOOGLE_CLIENT_SECRET_JSON (base64 JSON), decoded once per process."""
+    encoded_json = os.getenv("GOOGLE_CLIENT_SECRET_JSON")
+    if not encoded_json:
+        raise ValueError("Error: GOOGLE_CLIENT_SECRET_JSON environment variable not found!")
+    return json.loads(base64.b64decode(encoded_json).decode("utf-8"))
+
+
+def client_info():
+    config = client_config()
+    return config.get("web") or config.get("installed") or {}
+
+
+def new_flow():
+    """A Flow for one login; flows hold the fetched credentials, so sessions never share one."""
+    # No PKCE verifier: Google's redirect starts a new Streamlit session, which could not recover it
+    return Flow.from_client_config(
+        client_config(), scopes=SCOPES, redirect_uri=REDIRECT_URI, autogenerate_code_verifier=False
+    )
+
+
+def _max_age(cache_control):
+    match = _MAX_AGE.search(cache_control or "")
+    if not match or "no-store" in cache_control or "no-cache" in cache_control:
+        return 0
+    return int(match.group(1))
+
+
+class CertCache:
+    """Google's ID token signing certificates, kept until their Cache-Control max-age runs out.
+
+    Fetches go through one reusable ``requests`` session, so refreshes reuse
+    the pooled connection. ``session`` and ``clock`` can be swapped for a
+    stub to verify tokens offline.
+    """
+
+    def __init__(self, url=GOOGLE_CERTS_URL, session=None, clock=time.time):
+        self.url = url
+        self.session = session or requests.Session()
+        self.clock = clock
+        self._certs = None
+        self._expires = 0
+        self._fetched = 0
+        self._lock = threading.Lock()
+
+    def get(self, refresh=False):
+        """The current certificates; ``refresh`` refetches them unless they were just fetched."""
+        with self._lock:
+            now = self.clock()
+            stale = self._certs is None or now >= self._expires
+            if stale or (refresh and now - self._fetched >= CERTS_MIN_REFRESH):
+                response = self.session.get(self.url, timeout=10)
+                response.raise_for_status()
+                self._certs = response.json()
+                self._fetched = now
+                self._expires = now + _max_age(response.headers.get("Cache-Control"))
+            return self._certs
+
+
+_certs = CertCache()
+
+
+def verify_id_token(token, certs=None, audience=None):
+    """Verify a Google ID token against the cached certificates and return its claims."""
+    certs = certs or _certs
+    keys = certs.get()
+    if jwt.decode_header(token).get("kid") not in keys:
+        # Google rotated its keys since the last fetch
+        keys = certs.get(refresh=True)
+    id_info = jwt.decode(
+        token, certs=keys, audience=audience or client_info().get("client_id"), clock_skew_in_seconds=10
+    )
+    if id_info.get("iss") not in GOOGLE_ISSUERS:
+        raise ValueError(f"Wrong issuer. 'iss' should be one of the following: {list(GOOGLE_ISSUERS)}")
+    return id_info
+
+
+def login(auth_code):
+    """Exchange an authorization code for the user's verified ID token claims."""
+    flow = new_flow()
+    flow.fetch_token(code=auth_code)
+    return verify_id_token(flow.credentials.id_token)
+
+
+@lru_cache(maxsize=1)
+def session_secret():
+    """The dedicated key that session IDs are hashed with; it is never shared with the OAuth client."""
+    secret = os.getenv("SESSION_SECRET")
+    if not secret:
+        raise ValueError("Error: SESSION_SECRET environment variable not found!")
+    return secret.encode("utf-8")
+
+
+def _session_hash(session_id):
+    # Only this hash is stored, so the sessions table alone cannot be used to log in
+    return hmac.new(session_secret(), session_id.encode("utf-8"), hashlib.sha256).hexdigest()
+
+
+def create_session(name, email, ttl=SESSION_TTL):
+    """Store a new server-side session for the user and return its random ID for the cookie."""
+    session_id = secrets.token_urlsafe(32)
+    execute_query(PURGE_SESSIONS_QUERY)
+    execute_query(CREATE_SESSION_QUERY, (_session_hash(session_id), name, email, ttl))
+    return session_id
+
+
+def load_session(session_id):
+    """The user of a live session as {"name", "email"}, or None if it is unknown, expired or ended."""
+    if not session_id:
+        return None
+    row = fetch_one(LOAD_SESSION_QUERY, (_session_hash(session_id),))
+    return {"name": row[0], "email": row[1]} if row else None
+
+
+def end_session(session_id):
+    """Delete a session, so its cookie no longer logs anyone in."""
+    if session_id:
+        execute_query(END_SESSION_QUERY, (_session_hash(session_id),))
+
+
+def cookie_script(session_id, max_age=SESSION_TTL):
+    """A script that stores the session cookie in the browser, or clears it when ``session_id`` is None.
+
+    The cookie is Secure and SameSite=Lax and never appears in a URL. It
+    cannot be HttpOnly: Streamlit cannot set response headers, so it is
+    written from the page, and any script on the page can read it. It only
+    holds a random ID, though, whose session expires after SESSION_TTL and
+    is deleted at logout.
+    """
+    value = session_id or ""
+    age = max_age if session_id else 0
+    cookie = f"{SESSION_COOKIE}={value}; Max-Age={age}; Path=/; Secure; SameSite=Lax"
+    return f"<script>window.parent.document.cookie = {json.dumps(cookie)};</script>"
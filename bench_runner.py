@@ -0,0 +1,108 @@
+"""Startup and rerun latency of the page runner.
+
+Compares the old per-rerun path (list the pages directory, munge the names,
+read and compile the selected page) with the page registry, and checks which
+of the heavy libraries that only some pages need are loaded by the modules
+runner.py imports (streamlit, auth, db, google-auth, the registry, ...).
+Run with ``python bench_runner.py [iterations]``; no database or Streamlit
+server is needed, since pages are only compiled and runner.py's imports are
+only imported, not run.
+"""
+import os
+import ast
+import sys
+import time
+import subprocess
+
+from page_registry import PAGES_DIR, PageRegistry
+
+HEAVY_MODULES = ("openai", "weasyprint", "openpyxl")
+RUNNER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "runner.py")
+
+
+def old_rerun(page):
+    # What runner.py did on every rerun before the registry
+    pages = [f.replace(".py", "").replace("_", " ").title() for f in os.listdir(PAGES_DIR) if f.endswith(".py")]
+    file_path = os.path.join(PAGES_DIR, page.lower().replace(" ", "_") + ".py")
+    with open(file_path) as f:
+        compile(f.read(), file_path, "exec")
+    return pages
+
+
+def registry_rerun(registry, page):
+    pages = registry.titles()
+    registry.default_index()
+    registry.code(page)
+    return pages
+
+
+def per_call_ms(fn, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) * 1000 / iterations
+
+
+def import_ms(module):
+    # Cold import in a fresh interpreter, i.e. what a page pays the first time it needs it
+    code = f"import time; t = time.perf_counter(); import {module}; print((time.perf_counter() - t) * 1000)"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+    return float(result.stdout) if result.returncode == 0 else None
+
+
+def runner_imports(path=RUNNER):
+    """The modules runner.py imports at the top level, in order."""
+    with open(path) as f:
+        tree = ast.parse(f.read(), path)
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            modules += [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.level == 0:
+            modules.append(node.module)
+    return modules
+
+
+def runner_startup(modules):
+    # Import runner.py's modules in a fresh interpreter, without running the app itself
+    code = (
+        "import sys, time, importlib; t = time.perf_counter()\n"
+        f"for m in {modules!r}: importlib.import_module(m)\n"
+        "print((time.perf_counter() - t) * 1000)\n"
+        f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, cwd=os.path.dirname(RUNNER)
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing runner.py's modules failed:\n{result.stderr}")
+    ms, loaded = (result.stdout.splitlines() + [""])[:2]
+    return float(ms), loaded
+
+
+def main(iterations=200):
+    start = time.perf_counter()
+    registry = PageRegistry()
+    for page in registry.titles():
+        registry.code(page)
+    startup_ms = (time.perf_counter() - start) * 1000
+    print(f"registry startup (discover + compile {len(registry.pages)} pages): {startup_ms:.2f} ms")
+
+    print(f"\nper-rerun latency over {iterations} iterations:")
+    print(f"{'page':<22}{'old ms':>10}{'registry ms':>14}{'speedup':>10}")
+    for page in registry.titles():
+        old = per_call_ms(lambda: old_rerun(page), iterations)
+        new = per_call_ms(lambda: registry_rerun(registry, page), iterations)
+        print(f"{page:<22}{old:>10.3f}{new:>14.4f}{old / new:>9.0f}x")
+
+    modules = runner_imports()
+    ms, loaded = runner_startup(modules)
+    print(f"\nrunner.py imports ({', '.join(modules)}): {ms:.0f} ms")
+    print(f"heavy modules they load: {loaded or 'none'}")
+    for module in HEAVY_MODULES:
+        ms = import_ms(module)
+        print(f"  import {module:<12} {'not installed' if ms is None else f'{ms:.0f} ms, deferred until a page needs it'}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
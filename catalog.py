@@ -0,0 +1,230 @@
+import os
+import time
+import select
+import logging
+import threading
+
+import pandas as pd
+import psycopg2
+import psycopg2.extensions
+import db
+
+logger = logging.getLogger(__name__)
+
+# Reference tables cached process-wide and shared by every session
+REFERENCE_QUERIES = {
+    "customers": "SELECT * FROM customers;",
+    "items": "SELECT * FROM items;",
+    "customer_prompts": "SELECT * FROM customer_prompts;",
+    "customer_aliases": "SELECT * FROM customer_aliases;",
+    "customer_phones": "SELECT * FROM customer_phones;",
+    "customer_product_aliases": "SELECT customer_id, alias, product_id FROM customer_product_aliases;",
+}
+
+# Channel the catalog triggers notify on (payload is the table name)
+CATALOG_CHANNEL = "catalog_changed"
+
+# While the LISTEN connection is down, cached tables are only trusted this long
+CATALOG_FALLBACK_TTL = float(os.getenv("CATALOG_FALLBACK_TTL", "30"))
+
+
+class UnknownIdsError(ValueError):
+    """Raised when order lines reference customer or product IDs missing from the catalog."""
+
+    def __init__(self, key, ids):
+        self.key = key
+        self.ids = list(ids)
+        super().__init__(f"Unknown {key} value(s): {', '.join(self.ids)}")
+
+
+class CatalogIndex:
+    """id -> record lookup over a reference table such as customers or items.
+
+    IDs are compared as strings, the way order lines store them.
+    """
+
+    def __init__(self, df, key):
+        self.key = key
+        ids = df[key].astype(str)
+        self.ids = pd.Index(ids)
+        self.records = dict(zip(ids, df.to_dict("records")))
+        self._field_maps = {}
+
+    def __contains__(self, id_):
+        return str(id_) in self.records
+
+    def __len__(self):
+        return len(self.records)
+
+    def get(self, id_, default=None):
+        return self.records.get(str(id_), default)
+
+    def field_map(self, field):
+        """Precomputed id -> value dict for one column."""
+        if field not in self._field_maps:
+            self._field_maps[field] = {id_: record.get(field) for id_, record in self.records.items()}
+        return self._field_maps[field]
+
+    def unknown(self, ids):
+        """Sorted distinct IDs from ``ids`` that are not in the catalog."""
+        ids = pd.Series(ids, dtype=object).astype(str)
+        return sorted(ids[~ids.isin(self.ids)].unique())
+
+    def map(self, ids, field):
+        """Map a Series of IDs to ``field`` in one vectorized pass.
+
+        Raises UnknownIdsError listing every ID that is not in the catalog.
+        """
+        ids = ids.astype(str)
+        missing = self.unknown(ids)
+        if missing:
+            raise UnknownIdsError(self.key, missing)
+        return ids.map(self.field_map(field))
+
+
+class _CacheEntry:
+    __slots__ = ("version", "loaded_at", "df", "indexes")
+
+    def __init__(self, version, df):
+        self.version = version
+        self.loaded_at = time.monotonic()
+        self.df = df
+        self.indexes = {}
+
+
+_entries = {}
+_versions = {table: 0 for table in REFERENCE_QUERIES}
+_lock = threading.Lock()
+_load_locks = {table: threading.Lock() for table in REFERENCE_QUERIES}
+_derived = {}
+_listener = None
+_listening = threading.Event()
+
+
+def invalidate(table=None):
+    """Drop the cached copy of one reference table (or all of them)."""
+    tables = REFERENCE_QUERIES if table is None else [table]
+    with _lock:
+        for name in tables:
+            if name in _versions:
+                _versions[name] += 1
+
+
+def _fresh_entry(table):
+    entry = _entries.get(table)
+    if entry is None or entry.version != _versions[table]:
+        return None
+    if not _listening.is_set() and time.monotonic() - entry.loaded_at > CATALOG_FALLBACK_TTL:
+        return None
+    return entry
+
+
+def _get_entry(table):
+    if table not in REFERENCE_QUERIES:
+        raise KeyError(f"{table} is not a cached reference table")
+    _ensure_listener()
+    with _lock:
+        entry = _fresh_entry(table)
+    if entry is not None:
+        return entry
+    with _load_locks[table]:
+        # Another session may have reloaded the table while we waited
+        with _lock:
+            entry = _fresh_entry(table)
+            version = _versions[table]
+        if entry is None:
+            df = db.fetch_data_from_postgres(REFERENCE_QUERIES[table])
+            entry = _CacheEntry(version, df)
+            with _lock:
+                _entries[table] = entry
+    return entry
+
+
+def get_table(table):
+    """Return a copy of a cached reference table, loading it if needed."""
+    return _get_entry(table).df.copy()
+
+
+def get_index(table, key):
+    """Return the cached CatalogIndex of a reference table on ``key``."""
+    entry = _get_entry(table)
+    index = entry.indexes.get(key)
+    if index is None:
+        index = entry.indexes[key] = CatalogIndex(entry.df, key)
+    return index
+
+
+def derived(name, tables, build):
+    """Cache ``build(*dataframes)`` for the given reference tables until any of them changes."""
+    entries = tuple(_get_entry(table) for table in tables)
+    with _lock:
+        cached = _derived.get(name)
+    if cached is not None and all(old is new for old, new in zip(cached[0], entries)):
+        return cached[1]
+    value = build(*(entry.df for entry in entries))
+    with _lock:
+        _derived[name] = (entries, value)
+    return value
+
+
+def get_customers():
+    return get_table("customers")
+
+
+def get_items():
+    return get_table("items")
+
+
+def get_customer_prompts():
+    return get_table("customer_prompts")
+
+
+def get_customer_prompt(customer_id):
+    """Return the stored OpenAI prompt of a customer, or None if there is none."""
+    prompts = _get_entry("customer_prompts").df
+    if prompts.empty:
+        return None
+    match = prompts.loc[prompts["customer_id"].astype(str) == str(customer_id), "open_ai_prompt"]
+    return match.iloc[0] if not match.empty else None
+
+
+def _listen_forever():
+    while True:
+        conn = None
+        try:
+            conn = db.connect()
+            conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            with conn.cursor() as cur:
+                cur.execute(f"LISTEN {CATALOG_CHANNEL};")
+            # Anything cached before we started listening may have missed a change
+            invalidate()
+            _listening.set()
+            while True:
+                if select.select([conn], [], [], 60) == ([], [], []):
+                    # Keep the idle connection alive and surface a dead one
+                    with conn.cursor() as cur:
+                        cur.execute("SELECT 1;")
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    invalidate(notify.payload or None)
+        except Exception as e:
+            logger.warning("Catalog listener disconnected: %s", e)
+        finally:
+            _listening.clear()
+            if conn is not None:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+        time.sleep(5)
+
+
+def _ensure_listener():
+    global _listener
+    if _listener is None:
+        with _lock:
+            if _listener is None:
+                _listener = threading.Thread(target=_listen_forever, name="catalog-listener", daemon=True)
+                _listener.start()
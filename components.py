@@ -0,0 +1,114 @@
+import streamlit as st
+from orders import ORDERS_PAGE_SIZE, FILTER_PREVIEW_ROWS, fetch_orders_page, estimate_orders_count, fetch_filtered_orders
+from production_sheet import request_pdf
+
+
+def orders_grid(key="orders_grid", page_size=ORDERS_PAGE_SIZE):
+    """Show the orders table one keyset page at a time and return the visible page."""
+    # Stack of page keys; the last entry is the key the current page starts after
+    if key not in st.session_state:
+        st.session_state[key] = [None]
+    page_keys = st.session_state[key]
+
+    page_df, next_key = fetch_orders_page(after=page_keys[-1], page_size=page_size)
+
+    if page_df.empty and len(page_keys) == 1:
+        st.write("No data found in the 'orders' table.")
+        return page_df
+
+    st.dataframe(page_df)
+
+    # Callbacks run before the rerun, so inside a fragment only the fragment reruns
+    col1, col2, col3 = st.columns([1, 1, 4])
+    with col1:
+        st.button("Previous", key=f"{key}_prev", disabled=len(page_keys) == 1, on_click=page_keys.pop)
+    with col2:
+        st.button("Next", key=f"{key}_next", disabled=next_key is None, on_click=page_keys.append, args=(next_key,))
+    with col3:
+        st.caption(f"Page {len(page_keys)} · about {estimate_orders_count():,} order lines in total")
+
+    return page_df
+
+
+def filtered_orders_preview(where, params, limit=FILTER_PREVIEW_ROWS):
+    """Show the first ``limit`` order lines matching a filter and return them."""
+    # One extra row tells whether the filter matches more than the preview shows
+    df = fetch_filtered_orders(where, params, limit=limit + 1)
+    if len(df) > limit:
+        df = df.iloc[:limit]
+        st.write(f"Showing the first {limit} matching rows; the exports include all of them.")
+    else:
+        st.write(f"Filtered {len(df)} rows.")
+    st.dataframe(df)
+    return df
+
+
+def export_downloads(exports, filter_key, key="export"):
+    """Download buttons for exports that are only built when asked for.
+
+    ``exports`` holds (label, file_name, mime, build) tuples; ``build()``
+    returns the data as text, bytes or a binary file object. st.download_button
+    loads its whole file into memory, so each export waits behind its own
+    "Prepare" button and the result is kept only while ``filter_key`` stays the same.
+    """
+    prepared = st.session_state.get(key)
+    if prepared is None or prepared[0] != filter_key:
+        prepared = (filter_key, {})
+        st.session_state[key] = prepared
+    files = prepared[1]
+
+    for label, file_name, mime, build in exports:
+        if file_name not in files:
+            if not st.button(f"Prepare {label}", key=f"{key}_prepare_{file_name}"):
+                continue
+            with st.spinner(f"Preparing {label}..."):
+                data = build()
+                if hasattr(data, "read"):
+                    with data:
+                        data = data.read()
+            files[file_name] = data
+        st.download_button(
+            label=f"Download {label}", data=files[file_name], file_name=file_name, mime=mime,
+            key=f"{key}_download_{file_name}",
+        )
+
+
+def production_sheet_pdf(load, supply_date, filter_key, key="production_sheet"):
+    """Offer the production sheet of one supply date as a PDF.
+
+    Nothing is fetched or rendered until the user asks for it; ``load()``
+    then returns the order lines, which a background worker process renders.
+    """
+    request_key = f"{key}_request"
+    requested = st.session_state.get(request_key)
+    if requested is None or requested[0] != filter_key:
+        if not st.button("Prepare Production Sheet PDF", key=f"{key}_prepare"):
+            return
+        requested = (filter_key, request_pdf(load(), supply_date))
+        st.session_state[request_key] = requested
+    future = requested[1]
+    if not future.done():
+        _wait_for_pdf(future)
+        return
+    try:
+        pdf = future.result()
+    except Exception as e:
+        # Forget the failed request so the button offers a retry
+        st.session_state.pop(request_key, None)
+        st.error(f"Could not render the production sheet PDF: {e}")
+        return
+    st.download_button(
+        label="Download Production Sheet as PDF",
+        data=pdf,
+        file_name=f"production_sheet_{supply_date}.pdf",
+        mime="application/pdf",
+        key=key,
+    )
+
+
+@st.fragment(run_every=2)
+def _wait_for_pdf(future):
+    # Only this fragment polls; the full page reruns once the PDF is ready
+    if future.done():
+        st.rerun()
+    st.info("Preparing the production sheet PDF...")
@@ -0,0 +1,179 @@
+import re
+from collections import defaultdict, namedtuple
+
+import catalog
+
+# A match at or above this score that clearly beats the runner-up needs no LLM call
+CONFIDENT_SCORE = 0.9
+CONFIDENT_MARGIN = 0.2
+
+# Candidates below this score are not worth showing to the LLM
+MIN_CANDIDATE_SCORE = 0.35
+
+# How many candidates to hand to the LLM when the match is ambiguous
+MAX_CANDIDATES = 8
+
+Candidate = namedtuple("Candidate", ["customer_id", "customer_name", "score"])
+Resolution = namedtuple("Resolution", ["customer_id", "candidates"])
+
+_PHONE_SEPARATORS = re.compile(r"[,;/|]")
+_NIQQUD = re.compile("[\u0591-\u05c7]")
+_FINAL_LETTERS = str.maketrans("ךםןףץ", "כמנפצ")
+_NON_WORD = re.compile(r"[^\w]+")
+# One or two attached Hebrew prefix letters (ו, ה, ב, ל, מ, ש, כ), as in "לקפה גן"
+_HEBREW_PREFIX = "[והבלמשכ]{0,2}"
+
+
+def normalize(text):
+    """Lower-case, strip niqqud and punctuation, and fold Hebrew final letters."""
+    text = _NIQQUD.sub("", str(text)).lower().translate(_FINAL_LETTERS)
+    return " ".join(_NON_WORD.sub(" ", text).replace("_", " ").split())
+
+
+def trigrams(text):
+    padded = f" {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class CustomerResolver:
+    """In-memory trigram index over customer names and aliases.
+
+    ``resolve`` returns a confident customer_id when the message names one
+    customer outright, otherwise a short, ranked candidate list.
+    """
+
+    def __init__(self, customers_df, aliases_df=None):
+        self.names = {}
+        self._entries = []  # (customer_id, normalized name, trigram set, mention regex)
+        self._postings = defaultdict(set)
+
+        rows = [(row.customer_id, row.customer_name) for row in customers_df.itertuples(index=False)]
+        if aliases_df is not None and not aliases_df.empty:
+            rows += [(row.customer_id, row.alias) for row in aliases_df.itertuples(index=False)]
+
+        for customer_id, name in rows:
+            customer_id = str(customer_id)
+            self.names.setdefault(customer_id, str(name))
+            norm = normalize(name)
+            if not norm:
+                continue
+            grams = trigrams(norm)
+            mention = re.compile(rf"(?:^| ){_HEBREW_PREFIX}{re.escape(norm)}(?= |$)")
+            entry_idx = len(self._entries)
+            self._entries.append((customer_id, norm, grams, mention))
+            for gram in grams:
+                self._postings[gram].add(entry_idx)
+
+    def _score(self, message):
+        norm = normalize(message)
+        message_grams = trigrams(norm)
+        hits = defaultdict(int)
+        for gram in message_grams:
+            for entry_idx in self._postings.get(gram, ()):
+                hits[entry_idx] += 1
+
+        best = {}
+        exact = {}
+        for entry_idx, shared in hits.items():
+            customer_id, name, grams, mention = self._entries[entry_idx]
+            if mention.search(norm):
+                score = 1.0
+                if len(name) > len(exact.get(customer_id, "")):
+                    exact[customer_id] = name
+            else:
+                # Share of the name's trigrams found in the message
+                score = shared / len(grams)
+            if score > best.get(customer_id, 0.0):
+                best[customer_id] = score
+        return best, exact
+
+    def resolve(self, message):
+        best, exact = self._score(message)
+
+        # "Cafe Gan" inside "Cafe Gan Ramat Aviv" is not a competing mention
+        exact_names = list(exact.items())
+        dominated = {
+            customer_id for customer_id, name in exact_names
+            if any(name != other and name in other for _, other in exact_names)
+        }
+        for customer_id in dominated:
+            best[customer_id] = min(best[customer_id], CONFIDENT_SCORE - CONFIDENT_MARGIN)
+
+        ranked = sorted(best.items(), key=lambda item: item[1], reverse=True)
+        candidates = [
+            Candidate(customer_id, self.names[customer_id], score)
+            for customer_id, score in ranked[:MAX_CANDIDATES]
+            if score >= MIN_CANDIDATE_SCORE
+        ]
+        if candidates and candidates[0].score >= CONFIDENT_SCORE:
+            runner_up = candidates[1].score if len(candidates) > 1 else 0.0
+            if candidates[0].score - runner_up >= CONFIDENT_MARGIN:
+                return Resolution(candidates[0].customer_id, candidates)
+        return Resolution(None, candidates)
+
+
+def get_resolver():
+    """Resolver over the cached customers and aliases, rebuilt when either table changes."""
+    return catalog.derived("customer_resolver", ("customers", "customer_aliases"), CustomerResolver)
+
+
+def normalize_phone(raw):
+    """Normalize a phone number to international digits, e.g. 'whatsapp:+972 50-123-4567' -> '972501234567'.
+
+    Israeli local numbers (leading 0) get the 972 country code. Returns None
+    when nothing that looks like a phone number is left.
+    """
+    if raw is None:
+        return None
+    text = str(raw).strip()
+    if text.lower().startswith("whatsapp:"):
+        text = text[len("whatsapp:"):]
+    digits = re.sub(r"\D", "", text)
+    if digits.startswith("00"):
+        digits = digits[2:]
+    elif digits.startswith("0"):
+        digits = "972" + digits[1:]
+    return digits if len(digits) >= 8 else None
+
+
+def build_phone_index(customers_df, phones_df=None):
+    """Map normalized phone number -> customer_id.
+
+    Numbers registered in customer_phones win over the customers.Phone
+    column. A Phone value shared by several customers is left out, because
+    it cannot identify the sender.
+    """
+    index = {}
+    shared = set()
+    if "Phone" in customers_df.columns:
+        for customer_id, phones in zip(customers_df["customer_id"], customers_df["Phone"]):
+            if phones is None or phones != phones:  # None or NaN
+                continue
+            for phone in _PHONE_SEPARATORS.split(str(phones)):
+                phone = normalize_phone(phone)
+                if phone is None:
+                    continue
+                if phone in index and index[phone] != str(customer_id):
+                    shared.add(phone)
+                index[phone] = str(customer_id)
+    for phone in shared:
+        del index[phone]
+
+    if phones_df is not None and not phones_df.empty:
+        for phone, customer_id in zip(phones_df["phone"], phones_df["customer_id"]):
+            phone = normalize_phone(phone)
+            if phone is not None:
+                index[phone] = str(customer_id)
+    return index
+
+
+def get_phone_index():
+    return catalog.derived("phone_index", ("customers", "customer_phones"), build_phone_index)
+
+
+def customer_for_sender(from_number):
+    """Return the customer_id registered for a sender number, or None."""
+    phone = normalize_phone(from_number)
+    if phone is None:
+        return None
+    return get_phone_index().get(phone)
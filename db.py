@@ -0,0 +1,275 @@
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+import pandas as pd
+import psycopg2
+import psycopg2.extensions
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Pool settings, overridable from the environment
+POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+POOL_MAX_IDLE = float(os.getenv("DB_POOL_MAX_IDLE", "300"))
+POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", "3600"))
+POOL_HEALTH_CHECK_AFTER = float(os.getenv("DB_POOL_HEALTH_CHECK_AFTER", "30"))
+SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "250"))
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection becomes available within the pool timeout."""
+
+
+class _PooledConnection:
+    __slots__ = ("conn", "created_at", "last_used")
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+
+class ConnectionPool:
+    """Thread-safe pool of psycopg2 connections shared by the whole process.
+
+    Connections are opened lazily up to ``max_size``. A connection that sat
+    idle for longer than ``health_check_after`` seconds is pinged before it is
+    handed out, and connections older than ``max_lifetime`` or idle for longer
+    than ``max_idle`` are closed and replaced.
+    """
+
+    def __init__(self, dsn, min_size=POOL_MIN_SIZE, max_size=POOL_MAX_SIZE, timeout=POOL_TIMEOUT,
+                 max_idle=POOL_MAX_IDLE, max_lifetime=POOL_MAX_LIFETIME,
+                 health_check_after=POOL_HEALTH_CHECK_AFTER):
+        if not dsn:
+            raise ValueError("Error: DATABASE_URL environment variable not found!")
+        self.dsn = dsn
+        self.min_size = max(0, min(min_size, max_size))
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+        self.health_check_after = health_check_after
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._opened = 0
+        self._closed = False
+
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn, sslmode="require")
+        with self._lock:
+            self._opened += 1
+        return _PooledConnection(conn)
+
+    def _discard(self, entry):
+        try:
+            entry.conn.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._opened -= 1
+
+    def _is_stale(self, entry, now):
+        return (
+            entry.conn.closed
+            or now - entry.created_at > self.max_lifetime
+            or now - entry.last_used > self.max_idle
+        )
+
+    def _is_healthy(self, entry):
+        try:
+            with entry.conn.cursor() as cur:
+                cur.execute("SELECT 1;")
+            entry.conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self):
+        """Check a connection out of the pool, opening a new one if needed."""
+        if self._closed:
+            raise psycopg2.InterfaceError("connection pool is closed")
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolTimeout(f"No database connection available after {self.timeout}s")
+        try:
+            while True:
+                with self._lock:
+                    entry = self._idle.pop() if self._idle else None
+                if entry is None:
+                    return self._connect()
+                now = time.monotonic()
+                if self._is_stale(entry, now):
+                    self._discard(entry)
+                    continue
+                if now - entry.last_used > self.health_check_after and not self._is_healthy(entry):
+                    logger.info("Discarding unhealthy pooled connection")
+                    self._discard(entry)
+                    continue
+                return entry
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def putconn(self, entry, discard=False):
+        """Return a connection to the pool, rolling back any open transaction."""
+        try:
+            if not discard and not entry.conn.closed:
+                status = entry.conn.get_transaction_status()
+                if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                    discard = True
+                elif status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    try:
+                        entry.conn.rollback()
+                    except psycopg2.Error:
+                        discard = True
+            if discard or entry.conn.closed or self._closed:
+                self._discard(entry)
+                return
+            entry.last_used = time.monotonic()
+            with self._lock:
+                self._idle.append(entry)
+            self._recycle_idle()
+        finally:
+            self._slots.release()
+
+    def _recycle_idle(self):
+        # Close connections that sat idle too long, keeping at least min_size open
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            while len(self._idle) > self.min_size and now - self._idle[0].last_used > self.max_idle:
+                expired.append(self._idle.pop(0))
+        for entry in expired:
+            self._discard(entry)
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection for the duration of a ``with`` block."""
+        entry = self.getconn()
+        discard = False
+        try:
+            yield entry.conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            discard = True
+            raise
+        finally:
+            self.putconn(entry, discard=discard)
+
+    def close(self):
+        self._closed = True
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for entry in idle:
+            self._discard(entry)
+
+    def stats(self):
+        with self._lock:
+            return {"open": self._opened, "idle": len(self._idle), "max_size": self.max_size}
+
+
+def connect():
+    """Open a dedicated (unpooled) connection, e.g. for LISTEN."""
+    return psycopg2.connect(os.environ.get("DATABASE_URL"), sslmode="require")
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return the process-wide connection pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(os.environ.get("DATABASE_URL"))
+    return _pool
+
+
+def get_connection():
+    """Context manager yielding a pooled connection."""
+    return get_pool().connection()
+
+
+# Per-query timing, keyed by the first line of the statement
+_query_stats = {}
+_query_stats_lock = threading.Lock()
+
+
+def _query_label(query):
+    text = " ".join(str(query).split())
+    return text[:80]
+
+
+@contextmanager
+def timed(query):
+    """Time a statement and record it in the per-query statistics."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        label = _query_label(query)
+        with _query_stats_lock:
+            stats = _query_stats.setdefault(label, {"calls": 0, "total_ms": 0.0, "max_ms": 0.0})
+            stats["calls"] += 1
+            stats["total_ms"] += elapsed_ms
+            stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+        if elapsed_ms >= SLOW_QUERY_MS:
+            logger.warning("Slow query (%.1f ms): %s", elapsed_ms, label)
+        else:
+            logger.debug("Query (%.1f ms): %s", elapsed_ms, label)
+
+
+def query_stats():
+    """Return a DataFrame with call counts and latency per query."""
+    with _query_stats_lock:
+        rows = [
+            {"query": label, "calls": s["calls"], "total_ms": s["total_ms"],
+             "avg_ms": s["total_ms"] / s["calls"], "max_ms": s["max_ms"]}
+            for label, s in _query_stats.items()
+        ]
+    return pd.DataFrame(rows, columns=["query", "calls", "total_ms", "avg_ms", "max_ms"])
+
+
+# Function to fetch query results from PostgreSQL as a DataFrame
+def fetch_data_from_postgres(query, params=None):
+    with get_connection() as conn:
+        with timed(query):
+            df = pd.read_sql_query(query, conn, params=params)
+        conn.rollback()
+    return df
+
+
+# Function to fetch a single row (or None)
+def fetch_one(query, params=None):
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            with timed(query):
+                cur.execute(query, params)
+            row = cur.fetchone()
+        conn.rollback()
+    return row
+
+
+# Function to execute INSERT/UPDATE/DELETE queries
+def execute_query(query, params=None):
+    with get_connection() as conn:
+        try:
+            with conn.cursor() as cur:
+                with timed(query):
+                    cur.execute(query, params)
+                rowcount = cur.rowcount
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return rowcount
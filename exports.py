@@ -0,0 +1,112 @@
+import os
+import itertools
+import tempfile
+from db import get_connection, timed
+
+# Excel needs the UTF-8 BOM to detect the encoding of Hebrew CSV files
+CSV_BOM = "\ufeff".encode("utf-8")
+
+# Rows serialized per XML chunk, and rows fetched per round trip from a server-side cursor
+XML_CHUNK_ROWS = 1000
+XML_FETCH_SIZE = 2000
+
+
+def copy_csv(query, params=None):
+    """Export a query as CSV using ``COPY (query) TO STDOUT``.
+
+    Postgres streams the rows straight into a temporary file, so no DataFrame
+    is built for the export. Returns a binary file object positioned at the
+    start of the BOM-prefixed CSV; whoever reads it decides how much of it is
+    in memory at once (st.download_button reads all of it).
+    """
+    tmp = tempfile.NamedTemporaryFile(prefix="export_", suffix=".csv", delete=False)
+    try:
+        with tmp:
+            tmp.write(CSV_BOM)
+            with get_connection() as conn:
+                with conn.cursor() as cur:
+                    # COPY does not take bind parameters, so inline them safely first
+                    inner = cur.mogrify(query.strip().rstrip(";"), params).decode("utf-8")
+                    copy_sql = f"COPY ({inner}) TO STDOUT WITH (FORMAT csv, HEADER true, ENCODING 'UTF8')"
+                    with timed(copy_sql):
+                        cur.copy_expert(copy_sql, tmp)
+                conn.rollback()
+        return open(tmp.name, "rb")
+    finally:
+        # The open handle keeps the data readable after the name is gone
+        os.unlink(tmp.name)
+
+
+def _escape_xml_text(text):
+    # Same escaping ElementTree applies to element text
+    if "&" in text:
+        text = text.replace("&", "&amp;")
+    if "<" in text:
+        text = text.replace("<", "&lt;")
+    if ">" in text:
+        text = text.replace(">", "&gt;")
+    return text
+
+
+def iter_xml(rows, columns, root_tag="Orders", item_tag="Item", tags=None, chunk_rows=XML_CHUNK_ROWS):
+    """Serialize rows to XML incrementally, yielding UTF-8 encoded chunks.
+
+    Each row becomes an ``<Item>`` element with one child per column, named
+    after ``tags`` (defaults to the column names). The output is byte-for-byte
+    what ``ET.tostring(root, encoding="utf-8")`` produces for the same tree.
+    """
+    tags = list(tags or columns)
+    opening = [f"<{tag}>" for tag in tags]
+    closing = [f"</{tag}>" for tag in tags]
+    empty = [f"<{tag} />" for tag in tags]
+    item_open, item_close = f"<{item_tag}>", f"</{item_tag}>"
+
+    parts = []
+    wrote_any = False
+    for count, row in enumerate(rows, start=1):
+        if not wrote_any:
+            parts.append(f"<{root_tag}>")
+            wrote_any = True
+        parts.append(item_open)
+        for i, value in enumerate(row):
+            text = str(value)
+            if text:
+                parts.append(opening[i] + _escape_xml_text(text) + closing[i])
+            else:
+                parts.append(empty[i])
+        parts.append(item_close)
+        if count % chunk_rows == 0:
+            yield "".join(parts).encode("utf-8")
+            parts = []
+
+    parts.append(f"</{root_tag}>" if wrote_any else f"<{root_tag} />")
+    yield "".join(parts).encode("utf-8")
+
+
+def iter_dataframe_xml(df, root_tag="Orders", item_tag="Item", tags=None):
+    """Stream a DataFrame as XML chunks without building an ElementTree."""
+    return iter_xml(df.itertuples(index=False, name=None), list(df.columns), root_tag, item_tag, tags)
+
+
+def copy_xml(query, params=None, root_tag="Orders", item_tag="Item"):
+    """Export a query as XML, streaming rows from a server-side cursor into a temporary file.
+
+    Returns a binary file object positioned at the start of the document.
+    """
+    tmp = tempfile.NamedTemporaryFile(prefix="export_", suffix=".xml", delete=False)
+    try:
+        with tmp:
+            with get_connection() as conn:
+                with conn.cursor(name="xml_export") as cur:
+                    cur.itersize = XML_FETCH_SIZE
+                    with timed(query):
+                        cur.execute(query, params)
+                        first_rows = cur.fetchmany(XML_FETCH_SIZE)
+                    columns = [desc[0] for desc in cur.description]
+                    rows = itertools.chain(first_rows, cur)
+                    for chunk in iter_xml(rows, columns, root_tag, item_tag):
+                        tmp.write(chunk)
+                conn.rollback()
+        return open(tmp.name, "rb")
+    finally:
+        os.unlink(tmp.name)
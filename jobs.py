@@ -0,0 +1,407 @@
+import os
+import hashlib
+import logging
+import threading
+from collections import OrderedDict, namedtuple
+
+from psycopg2.extras import Json
+from db import get_connection, timed
+from customer_resolver import normalize, normalize_phone
+
+logger = logging.getLogger(__name__)
+
+# Worker settings, overridable from the environment
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1"))
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "300"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_RETRY_BASE = float(os.getenv("JOB_RETRY_BASE", "5"))
+JOB_RETRY_MAX = float(os.getenv("JOB_RETRY_MAX", "600"))
+
+# The same text from the same sender within this many seconds, while the first
+# copy is still queued or running, is treated as a resubmission
+IDEMPOTENCY_WINDOW = float(os.getenv("IDEMPOTENCY_WINDOW", "120"))
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "2048"))
+
+Job = namedtuple(
+    "Job", ["id", "message_sid", "from_number", "to_number", "body", "attempts", "order_id", "locked_at", "segments"]
+)
+JobStatus = namedtuple("JobStatus", ["status", "order_id", "result"])
+
+ENQUEUE_QUERY = """
+INSERT INTO webhook_jobs (message_sid, from_number, to_number, body)
+VALUES (%s, %s, %s, %s)
+RETURNING id;
+"""
+
+# Take the oldest due job no other worker holds. A claimed job gets a lease
+# (run_after moves into the future), so a job whose worker died is picked up
+# again once the lease runs out, unless it has used up its attempts.
+CLAIM_QUERY = """
+UPDATE webhook_jobs
+SET status = 'running', attempts = attempts + 1, locked_at = clock_timestamp(),
+    run_after = now() + make_interval(secs => %s)
+WHERE id = (
+    SELECT id FROM webhook_jobs
+    WHERE status IN ('pending', 'running') AND run_after <= now() AND attempts < %s
+    ORDER BY run_after, id
+    FOR UPDATE SKIP LOCKED
+    LIMIT 1
+)
+RETURNING id, message_sid, from_number, to_number, body, attempts, order_id, locked_at, segments;
+"""
+
+# Extend the lease of a running job, as long as the claim that took it still holds it
+HEARTBEAT_QUERY = """
+UPDATE webhook_jobs
+SET run_after = now() + make_interval(secs => %s)
+WHERE id = %s AND status = 'running' AND locked_at = %s;
+"""
+
+# Jobs whose worker died (or crashed the process) on their last attempt
+SWEEP_QUERY = """
+UPDATE webhook_jobs
+SET status = 'failed', last_error = 'Worker lost on the last attempt', locked_at = NULL, finished_at = now()
+WHERE id IN (
+    SELECT id FROM webhook_jobs
+    WHERE status = 'running' AND run_after <= now() AND attempts >= %s
+    FOR UPDATE SKIP LOCKED
+)
+RETURNING id, message_sid, from_number, to_number, body, attempts, order_id, locked_at, segments;
+"""
+
+CLAIM_SID_KEY_QUERY = """
+INSERT INTO webhook_message_keys (key, job_id) VALUES (%s, %s)
+ON CONFLICT (key) DO NOTHING
+RETURNING job_id;
+"""
+
+# A content key is taken over by the new job once it is older than the window
+# or its job has finished, so a genuine repeat order is never swallowed
+CLAIM_CONTENT_KEY_QUERY = """
+INSERT INTO webhook_message_keys (key, job_id) VALUES (%s, %s)
+ON CONFLICT (key) DO UPDATE SET job_id = EXCLUDED.job_id, created_at = now()
+WHERE webhook_message_keys.created_at < now() - make_interval(secs => %s)
+   OR NOT EXISTS (
+       SELECT 1 FROM webhook_jobs j
+       WHERE j.id = webhook_message_keys.job_id AND j.status IN ('pending', 'running')
+   )
+RETURNING job_id;
+"""
+
+FIND_KEY_QUERY = "SELECT job_id FROM webhook_message_keys WHERE key = %s;"
+
+JOB_STATUS_QUERY = "SELECT status, order_id, result FROM webhook_jobs WHERE id = %s;"
+
+# The first order ID recorded for a job wins; later runs get that one back
+SET_ORDER_ID_QUERY = """
+UPDATE webhook_jobs SET order_id = COALESCE(order_id, %s) WHERE id = %s
+RETURNING order_id;
+"""
+
+# Likewise, the first segment split recorded for a job is the one every run uses
+SET_SEGMENTS_QUERY = """
+UPDATE webhook_jobs SET segments = COALESCE(segments, %s) WHERE id = %s
+RETURNING segments;
+"""
+
+COMPLETE_QUERY = """
+UPDATE webhook_jobs
+SET status = 'done', result = %s, locked_at = NULL, finished_at = now()
+WHERE id = %s;
+"""
+
+RETRY_QUERY = """
+UPDATE webhook_jobs
+SET status = 'pending', last_error = %s, locked_at = NULL,
+    run_after = now() + make_interval(secs => %s)
+WHERE id = %s;
+"""
+
+FAIL_QUERY = """
+UPDATE webhook_jobs
+SET status = 'failed', last_error = %s, locked_at = NULL, finished_at = now()
+WHERE id = %s;
+"""
+
+_wake = threading.Event()
+_stop = threading.Event()
+_workers = []
+_workers_lock = threading.Lock()
+
+# MessageSid key -> job_id, in front of webhook_message_keys
+_seen = OrderedDict()
+_seen_lock = threading.Lock()
+
+
+def _execute(query, params, fetch=False):
+    with get_connection() as conn:
+        try:
+            with conn.cursor() as cur:
+                with timed(query):
+                    cur.execute(query, params)
+                row = cur.fetchone() if fetch else None
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return row
+
+
+def enqueue_message(body, from_number=None, to_number=None, message_sid=None):
+    """Store an incoming message for the workers and return the job id."""
+    job_id = _execute(ENQUEUE_QUERY, (message_sid, from_number, to_number, body), fetch=True)[0]
+    # Workers in this process start on it right away; others find it on their next poll
+    _wake.set()
+    return job_id
+
+
+def message_keys(message_sid, from_number, body):
+    """Idempotency keys of an incoming message: its MessageSid and a hash of sender and text.
+
+    The text is normalized (case, punctuation, niqqud, spacing) first, so a
+    resubmission with cosmetic edits maps to the same key.
+    """
+    content = f"{normalize_phone(from_number) or from_number or ''}\n{normalize(body)}"
+    keys = {"content": "body:" + hashlib.sha256(content.encode("utf-8")).hexdigest()}
+    if message_sid:
+        keys["sid"] = f"sid:{message_sid}"
+    return keys
+
+
+# Only MessageSid keys are cached: whether a content key still counts depends
+# on the state of its job, which only the database knows
+def _remember(keys, job_id):
+    if "sid" not in keys:
+        return
+    with _seen_lock:
+        _seen[keys["sid"]] = job_id
+        _seen.move_to_end(keys["sid"])
+        while len(_seen) > IDEMPOTENCY_CACHE_SIZE:
+            _seen.popitem(last=False)
+
+
+def _recall(keys):
+    if "sid" not in keys:
+        return None
+    with _seen_lock:
+        job_id = _seen.get(keys["sid"])
+        if job_id is not None:
+            _seen.move_to_end(keys["sid"])
+        return job_id
+
+
+def enqueue_message_once(body, from_number=None, to_number=None, message_sid=None):
+    """Queue a message unless it was already queued; return (job_id, duplicate).
+
+    ``duplicate`` is None for a new job. It is "sid" for a Twilio retry of the
+    same MessageSid, and "content" for the same text from the same sender
+    within IDEMPOTENCY_WINDOW while the first copy is still pending or
+    running. Both return the existing job. A resubmission's MessageSid is
+    recorded against that job, so Twilio retries of it come back as "sid".
+    Twilio retries are answered from an in-memory LRU when possible.
+    """
+    keys = message_keys(message_sid, from_number, body)
+    job_id = _recall(keys)
+    if job_id is not None:
+        return job_id, "sid"
+
+    with get_connection() as conn:
+        try:
+            with conn.cursor() as cur:
+                with timed(ENQUEUE_QUERY):
+                    cur.execute(ENQUEUE_QUERY, (message_sid, from_number, to_number, body))
+                job_id = cur.fetchone()[0]
+                claims = []
+                if "sid" in keys:
+                    claims.append(("sid", CLAIM_SID_KEY_QUERY, (keys["sid"], job_id)))
+                claims.append(("content", CLAIM_CONTENT_KEY_QUERY, (keys["content"], job_id, IDEMPOTENCY_WINDOW)))
+                for kind, query, params in claims:
+                    cur.execute(query, params)
+                    if cur.fetchone() is None:
+                        # Already queued: drop the new job and point at the original
+                        conn.rollback()
+                        cur.execute(FIND_KEY_QUERY, (keys[kind],))
+                        row = cur.fetchone()
+                        conn.rollback()
+                        if row is None:
+                            raise RuntimeError(f"Idempotency key {keys[kind]} vanished")
+                        job_id = row[0]
+                        if kind == "content" and "sid" in keys:
+                            # Record this delivery's MessageSid against the original job,
+                            # so Twilio retries of the resubmission are answered only once
+                            cur.execute(CLAIM_SID_KEY_QUERY, (keys["sid"], job_id))
+                            if cur.fetchone() is None:
+                                # A concurrent retry of the same delivery recorded it first
+                                cur.execute(FIND_KEY_QUERY, (keys["sid"],))
+                                job_id, kind = cur.fetchone()[0], "sid"
+                            conn.commit()
+                        _remember(keys, job_id)
+                        return job_id, kind
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    _remember(keys, job_id)
+    _wake.set()
+    return job_id, None
+
+
+def job_status(job_id):
+    """The JobStatus of a queued message, or None if there is no such job."""
+    row = _execute(JOB_STATUS_QUERY, (job_id,), fetch=True)
+    return JobStatus(*row) if row else None
+
+
+def set_job_order_id(job_id, order_id):
+    """Record the order ID a job allocated, unless it already has one; return the job's order ID.
+
+    Insert the order lines only under the returned ID: if another run of the
+    job got there first, that run's ID is returned instead of ``order_id``.
+    """
+    return _execute(SET_ORDER_ID_QUERY, (str(order_id), job_id), fetch=True)[0]
+
+
+def set_job_order_ids(job_id, order_ids):
+    """set_job_order_id for a message that becomes several orders; return the job's list of order IDs."""
+    return set_job_order_id(job_id, ",".join(str(order_id) for order_id in order_ids)).split(",")
+
+
+def set_job_segments(job_id, segments):
+    """Record how a job's message was split (a JSON-ready list) unless already recorded; return the stored split."""
+    return _execute(SET_SEGMENTS_QUERY, (Json(segments), job_id), fetch=True)[0]
+
+
+def claim_job():
+    """Lease the next due job, or return None when the queue is empty."""
+    row = _execute(CLAIM_QUERY, (JOB_LEASE_SECONDS, JOB_MAX_ATTEMPTS), fetch=True)
+    return Job(*row) if row else None
+
+
+def extend_lease(job):
+    _execute(HEARTBEAT_QUERY, (JOB_LEASE_SECONDS, job.id, job.locked_at))
+
+
+def sweep_jobs():
+    """Mark running jobs that lost their worker on the last attempt as failed and return them."""
+    with get_connection() as conn:
+        try:
+            with conn.cursor() as cur:
+                with timed(SWEEP_QUERY):
+                    cur.execute(SWEEP_QUERY, (JOB_MAX_ATTEMPTS,))
+                rows = cur.fetchall()
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return [Job(*row) for row in rows]
+
+
+def complete_job(job_id, result=None):
+    _execute(COMPLETE_QUERY, (result, job_id))
+
+
+def retry_job(job_id, error, delay):
+    _execute(RETRY_QUERY, (str(error), delay, job_id))
+
+
+def fail_job(job_id, error):
+    _execute(FAIL_QUERY, (str(error), job_id))
+
+
+def _retry_delay(attempts):
+    return min(JOB_RETRY_MAX, JOB_RETRY_BASE * 2 ** (attempts - 1))
+
+
+def _heartbeat(job, done):
+    # Renew the lease well before it runs out, so no other worker claims a job that is still running
+    while not done.wait(JOB_LEASE_SECONDS / 3):
+        try:
+            extend_lease(job)
+        except Exception as e:
+            logger.warning("Could not extend the lease of job %s: %s", job.id, e)
+
+
+def _give_up(job, error, on_give_up):
+    if on_give_up is not None:
+        try:
+            on_give_up(job, error)
+        except Exception:
+            logger.exception("on_give_up for job %s failed", job.id)
+
+
+def run_job(job, handler, on_give_up=None):
+    """Run ``handler(job)`` and record the outcome.
+
+    The job's lease is renewed while the handler runs. A job that raises is
+    retried with exponential backoff. After JOB_MAX_ATTEMPTS it is marked
+    failed and ``on_give_up(job, error)`` is called.
+    """
+    done = threading.Event()
+    heartbeat = threading.Thread(target=_heartbeat, args=(job, done), name=f"job-{job.id}-lease", daemon=True)
+    heartbeat.start()
+    try:
+        result = handler(job)
+    except Exception as e:
+        if job.attempts < JOB_MAX_ATTEMPTS:
+            delay = _retry_delay(job.attempts)
+            logger.warning("Job %s failed (attempt %s), retrying in %.0fs: %s", job.id, job.attempts, delay, e)
+            retry_job(job.id, e, delay)
+            return
+        logger.error("Job %s failed after %s attempts: %s", job.id, job.attempts, e)
+        fail_job(job.id, e)
+        _give_up(job, e, on_give_up)
+        return
+    finally:
+        done.set()
+    complete_job(job.id, None if result is None else str(result))
+
+
+def _work(handler, on_give_up):
+    while not _stop.is_set():
+        try:
+            job = claim_job()
+        except Exception as e:
+            logger.warning("Could not claim a job: %s", e)
+            _stop.wait(JOB_POLL_INTERVAL * 5)
+            continue
+        if job is None:
+            # While idle, fail jobs that crashed or killed their worker on every attempt
+            try:
+                for lost in sweep_jobs():
+                    logger.error("Job %s lost its worker on all %s attempts", lost.id, lost.attempts)
+                    _give_up(lost, RuntimeError("the message could not be processed"), on_give_up)
+            except Exception as e:
+                logger.warning("Could not sweep lost jobs: %s", e)
+            _wake.wait(JOB_POLL_INTERVAL)
+            _wake.clear()
+            continue
+        try:
+            run_job(job, handler, on_give_up)
+        except Exception:
+            # Recording the outcome failed; the lease expires and the job runs again
+            logger.exception("Could not record the outcome of job %s", job.id)
+
+
+def start_workers(handler, on_give_up=None, count=JOB_WORKERS):
+    """Start ``count`` daemon threads draining the job queue (once per process)."""
+    with _workers_lock:
+        if _workers:
+            return
+        _stop.clear()
+        for i in range(count):
+            worker = threading.Thread(
+                target=_work, args=(handler, on_give_up), name=f"job-worker-{i}", daemon=True
+            )
+            worker.start()
+            _workers.append(worker)
+
+
+def stop_workers(timeout=None):
+    """Ask the workers to stop after their current job and wait for them."""
+    _stop.set()
+    _wake.set()
+    with _workers_lock:
+        for worker in _workers:
+            worker.join(timeout)
+        _workers.clear()
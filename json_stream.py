@@ -0,0 +1,79 @@
+import re
+import json
+
+# Text a model may put before the JSON, e.g. the opening of a ```json fence
+_ALLOWED_PREFIX = re.compile(r"`{0,3}[a-zA-Z]*")
+
+
+def iter_json_records(chunks):
+    """Yield the objects of a JSON array (or a single object) as soon as each one closes.
+
+    ``chunks`` is any iterable of text pieces, such as a streamed completion.
+    Raises ValueError as soon as the text stops looking like a JSON array of
+    objects, instead of after the whole response arrived.
+    """
+    started = single = done = False
+    prefix = []
+    record = []
+    depth = 0
+    in_string = escape = False
+
+    for chunk in chunks:
+        for ch in chunk:
+            if done:
+                # Only whitespace or a closing ``` fence may follow
+                if ch.isspace() or ch == "`":
+                    continue
+                raise ValueError(f"Unexpected {ch!r} after the end of the JSON in the AI response.")
+
+            if not started:
+                if ch in "[{":
+                    started = True
+                    if ch == "{":
+                        single = True
+                        depth = 1
+                        record.append(ch)
+                    continue
+                prefix.append(ch)
+                if not _ALLOWED_PREFIX.fullmatch("".join(prefix).strip()):
+                    raise ValueError("The AI response does not start with a JSON array.")
+                continue
+
+            if depth == 0:
+                # Between records of the array
+                if ch.isspace() or ch == ",":
+                    continue
+                if ch == "{":
+                    depth = 1
+                    record.append(ch)
+                    continue
+                if ch == "]":
+                    done = True
+                    continue
+                raise ValueError(f"Unexpected {ch!r} in the AI response; expected an order line object.")
+
+            record.append(ch)
+            if in_string:
+                if escape:
+                    escape = False
+                elif ch == "\\":
+                    escape = True
+                elif ch == '"':
+                    in_string = False
+            elif ch == '"':
+                in_string = True
+            elif ch in "{[":
+                depth += 1
+            elif ch in "}]":
+                depth -= 1
+                if depth == 0:
+                    try:
+                        yield json.loads("".join(record))
+                    except json.JSONDecodeError as e:
+                        raise ValueError(f"The AI response contains an invalid order line: {e}")
+                    record = []
+                    if single:
+                        done = True
+
+    if not done:
+        raise ValueError("The AI response ended before the JSON was complete.")
@@ -0,0 +1,385 @@
+import os
+import time
+import random
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Gateway settings, overridable from the environment
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "10"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_RATE_PER_SECOND = float(os.getenv("LLM_RATE_PER_SECOND", "5"))
+LLM_RATE_BURST = int(os.getenv("LLM_RATE_BURST", "10"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "30"))
+
+# Number of recent call latencies kept per model for percentiles
+LATENCY_WINDOW = 500
+
+
+class LLMBusyError(RuntimeError):
+    """Raised when a call could not get a rate-limit token or concurrency slot in time."""
+
+
+class TokenBucket:
+    """Thread-safe token bucket: ``rate`` tokens per second, up to ``capacity`` saved up."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+class _ModelMetrics:
+    __slots__ = ("calls", "errors", "retries", "latencies", "prompt_tokens", "cached_tokens")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+
+
+_client = None
+_client_lock = threading.Lock()
+_bucket = TokenBucket(LLM_RATE_PER_SECOND, LLM_RATE_BURST)
+_slots = threading.BoundedSemaphore(LLM_MAX_CONCURRENCY)
+_metrics = {}
+_metrics_lock = threading.Lock()
+_cascade_metrics = {}
+_prompt_metrics = {}
+_warmed = threading.Event()
+
+
+def get_client():
+    """Return the process-wide OpenAI client, which keeps its HTTP connections alive between calls."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                import httpx
+                from openai import OpenAI, DefaultHttpxClient
+                timeout = httpx.Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT)
+                http_client = DefaultHttpxClient(
+                    timeout=timeout,
+                    limits=httpx.Limits(
+                        max_connections=LLM_MAX_CONCURRENCY,
+                        max_keepalive_connections=LLM_MAX_CONCURRENCY,
+                        keepalive_expiry=120,
+                    ),
+                )
+                # Retries are handled here, with jitter and metrics, not by the SDK
+                _client = OpenAI(
+                    api_key=os.getenv("OPENAI_API_KEY"),
+                    timeout=timeout,
+                    max_retries=0,
+                    http_client=http_client,
+                )
+    return _client
+
+
+def warm():
+    """Open the pooled HTTPS connection in the background so the first real call skips the handshake."""
+    if _warmed.is_set() or not os.getenv("OPENAI_API_KEY"):
+        return
+    _warmed.set()
+
+    def _warm():
+        try:
+            get_client().models.list()
+        except Exception as e:
+            logger.info("LLM warm-up failed: %s", e)
+
+    threading.Thread(target=_warm, name="llm-warmup", daemon=True).start()
+
+
+def _retry_delay(error, attempt):
+    # Honour Retry-After when the API sends it, otherwise full-jitter exponential backoff
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            return min(float(retry_after), LLM_BACKOFF_MAX)
+        except ValueError:
+            pass
+    return random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt))
+
+
+def _is_retryable(error):
+    import openai
+    if isinstance(error, (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+def _model_metrics(model):
+    metrics = _metrics.get(model)
+    if metrics is None:
+        metrics = _metrics.setdefault(model, _ModelMetrics())
+    return metrics
+
+
+def _token_usage(completion):
+    usage = getattr(completion, "usage", None)
+    if usage is None:
+        return 0, 0
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None) or 0
+    return usage.prompt_tokens or 0, cached
+
+
+def _record(model, elapsed_ms, retries, error=None, completion=None, prompt_version=None):
+    with _metrics_lock:
+        metrics = _model_metrics(model)
+        metrics.calls += 1
+        metrics.retries += retries
+        if error is not None:
+            metrics.errors += 1
+            return
+        metrics.latencies.append(elapsed_ms)
+        prompt_tokens, cached_tokens = _token_usage(completion)
+        metrics.prompt_tokens += prompt_tokens
+        metrics.cached_tokens += cached_tokens
+        if prompt_version is not None:
+            version = _prompt_metrics.get(prompt_version)
+            if version is None:
+                version = _prompt_metrics[prompt_version] = _ModelMetrics()
+            version.calls += 1
+            version.latencies.append(elapsed_ms)
+            version.prompt_tokens += prompt_tokens
+            version.cached_tokens += cached_tokens
+
+
+def chat(messages, model, prompt_version=None, **kwargs):
+    """Create a chat completion through the shared client.
+
+    Calls are rate limited and capped in concurrency. 429s, 5xx responses,
+    timeouts and connection errors are retried with jittered exponential backoff.
+    ``prompt_version`` groups the prompt-cache statistics of calls sharing a prefix.
+    """
+    _acquire()
+    try:
+        start = time.perf_counter()
+        completion, attempt = _create(start, model=model, messages=messages, **kwargs)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        _record(model, elapsed_ms, attempt, completion=completion, prompt_version=prompt_version)
+        logger.debug("LLM call to %s took %.0f ms", model, elapsed_ms)
+        return completion
+    finally:
+        _slots.release()
+
+
+def _acquire():
+    if not _bucket.acquire(timeout=LLM_QUEUE_TIMEOUT):
+        raise LLMBusyError("Too many LLM requests, please try again shortly.")
+    if not _slots.acquire(timeout=LLM_QUEUE_TIMEOUT):
+        raise LLMBusyError("All LLM connections are busy, please try again shortly.")
+
+
+def _create(start, **kwargs):
+    # Create a completion, retrying transient failures; returns (completion, retries)
+    client = get_client()
+    attempt = 0
+    while True:
+        try:
+            return client.chat.completions.create(**kwargs), attempt
+        except Exception as e:
+            if attempt >= LLM_MAX_RETRIES or not _is_retryable(e):
+                _record(kwargs["model"], (time.perf_counter() - start) * 1000, attempt, error=e)
+                raise
+            delay = _retry_delay(e, attempt)
+            logger.warning("LLM call to %s failed (%s), retrying in %.1fs", kwargs["model"], e, delay)
+            time.sleep(delay)
+            attempt += 1
+
+
+def complete(messages, model, **kwargs):
+    """Return just the text of a chat completion."""
+    return chat(messages, model, **kwargs).choices[0].message.content
+
+
+def stream(messages, model, prompt_version=None, **kwargs):
+    """Yield the text of a chat completion as it is generated.
+
+    Same rate limit, concurrency cap and retries as ``chat``; retries only
+    happen before the first token. Closing the generator early aborts the
+    request and frees its slot.
+    """
+    _acquire()
+    response = None
+    try:
+        start = time.perf_counter()
+        response, attempt = _create(
+            start, model=model, messages=messages, stream=True,
+            stream_options={"include_usage": True}, **kwargs
+        )
+        usage_chunk = None
+        first_token_ms = None
+        try:
+            for chunk in response:
+                if getattr(chunk, "usage", None) is not None:
+                    usage_chunk = chunk
+                if chunk.choices and chunk.choices[0].delta.content:
+                    if first_token_ms is None:
+                        first_token_ms = (time.perf_counter() - start) * 1000
+                    yield chunk.choices[0].delta.content
+        except Exception as e:
+            _record(model, (time.perf_counter() - start) * 1000, attempt, error=e)
+            raise
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        _record(model, elapsed_ms, attempt, completion=usage_chunk, prompt_version=prompt_version)
+        logger.debug("LLM stream from %s: first token %.0f ms, done %.0f ms", model, first_token_ms or 0, elapsed_ms)
+    finally:
+        if response is not None:
+            response.close()
+        _slots.release()
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def metrics():
+    """Per-model call counts, retries, errors and latency percentiles (ms)."""
+    with _metrics_lock:
+        return [
+            {
+                "model": model,
+                "calls": m.calls,
+                "errors": m.errors,
+                "retries": m.retries,
+                "avg_ms": sum(m.latencies) / len(m.latencies) if m.latencies else None,
+                "p50_ms": _percentile(m.latencies, 0.5),
+                "p95_ms": _percentile(m.latencies, 0.95),
+                "cached_token_ratio": m.cached_tokens / m.prompt_tokens if m.prompt_tokens else None,
+            }
+            for model, m in _metrics.items()
+        ]
+
+
+def prompt_metrics():
+    """Per prompt version: calls, prompt tokens, share served from the provider's prompt cache, latency."""
+    with _metrics_lock:
+        return [
+            {
+                "prompt_version": version,
+                "calls": m.calls,
+                "prompt_tokens": m.prompt_tokens,
+                "cached_tokens": m.cached_tokens,
+                "cached_token_ratio": m.cached_tokens / m.prompt_tokens if m.prompt_tokens else None,
+                "p50_ms": _percentile(m.latencies, 0.5),
+            }
+            for version, m in _prompt_metrics.items()
+        ]
+
+
+def cascade(step, models, call, accept):
+    """Run ``call(model)`` on each model in turn, cheapest first, until ``accept(result)`` is true.
+
+    A tier that errors or whose result is rejected escalates to the next
+    one. The last tier's result is returned even if rejected, so callers see
+    the same errors as without a cascade. Per-tier hit rates and latency are
+    kept under ``step``.
+    """
+    for tier, model in enumerate(models):
+        last = tier == len(models) - 1
+        start = time.perf_counter()
+        try:
+            result = call(model)
+        except LLMBusyError:
+            raise
+        except Exception as e:
+            _record_tier(step, tier, model, (time.perf_counter() - start) * 1000, False)
+            if last:
+                raise
+            logger.info("%s: %s failed (%s), escalating", step, model, e)
+            continue
+        accepted = accept(result)
+        _record_tier(step, tier, model, (time.perf_counter() - start) * 1000, accepted)
+        if accepted or last:
+            return result
+        logger.info("%s: %s result rejected, escalating", step, model)
+
+
+def cascade_stream(step, models, produce, on_restart=None):
+    """Streaming counterpart of ``cascade``: yield the items of ``produce(model)`` tier by tier.
+
+    A tier that raises (e.g. a record fails validation mid-stream) escalates
+    to the next model; ``on_restart()`` is called first so the consumer can
+    drop the items it already received. The last tier's error is raised.
+    """
+    for tier, model in enumerate(models):
+        last = tier == len(models) - 1
+        start = time.perf_counter()
+        emitted = False
+        try:
+            for item in produce(model):
+                emitted = True
+                yield item
+        except LLMBusyError:
+            raise
+        except Exception as e:
+            _record_tier(step, tier, model, (time.perf_counter() - start) * 1000, False)
+            if last:
+                raise
+            logger.info("%s: %s failed mid-stream (%s), escalating", step, model, e)
+            if emitted and on_restart is not None:
+                on_restart()
+            continue
+        _record_tier(step, tier, model, (time.perf_counter() - start) * 1000, True)
+        return
+
+
+def _record_tier(step, tier, model, elapsed_ms, accepted):
+    with _metrics_lock:
+        metrics = _cascade_metrics.get((step, tier, model))
+        if metrics is None:
+            metrics = _cascade_metrics[(step, tier, model)] = _ModelMetrics()
+        metrics.calls += 1
+        if not accepted:
+            metrics.errors += 1
+        metrics.latencies.append(elapsed_ms)
+
+
+def cascade_metrics():
+    """Per step and tier: calls, share of results accepted, and latency percentiles (ms)."""
+    with _metrics_lock:
+        return [
+            {
+                "step": step,
+                "tier": tier,
+                "model": model,
+                "calls": m.calls,
+                "hit_rate": (m.calls - m.errors) / m.calls if m.calls else None,
+                "p50_ms": _percentile(m.latencies, 0.5),
+                "p95_ms": _percentile(m.latencies, 0.95),
+            }
+            for (step, tier, model), m in sorted(_cascade_metrics.items())
+        ]
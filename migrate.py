@@ -0,0 +1,39 @@
+import os
+from db import get_connection
+
+# Directory holding the numbered .sql migration files
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+
+def apply_migrations():
+    """Apply every migration in MIGRATIONS_DIR that has not been applied yet, in name order."""
+    applied_now = []
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                name TEXT PRIMARY KEY,
+                applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            );
+            """)
+            cur.execute("SELECT name FROM schema_migrations;")
+            applied = {row[0] for row in cur.fetchall()}
+        conn.commit()
+
+        for name in sorted(f for f in os.listdir(MIGRATIONS_DIR) if f.endswith(".sql")):
+            if name in applied:
+                continue
+            with open(os.path.join(MIGRATIONS_DIR, name), encoding="utf-8") as f:
+                sql = f.read()
+            # Each migration runs in its own transaction together with its bookkeeping row
+            with conn.cursor() as cur:
+                cur.execute(sql)
+                cur.execute("INSERT INTO schema_migrations (name) VALUES (%s);", (name,))
+            conn.commit()
+            applied_now.append(name)
+    return applied_now
+
+
+if __name__ == "__main__":
+    for name in apply_migrations():
+        print(f"Applied {name}")
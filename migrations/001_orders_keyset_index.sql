@@ -0,0 +1,3 @@
+-- Supports keyset pagination of the orders grid on (supply_date, order_id)
+CREATE INDEX IF NOT EXISTS orders_supply_date_order_id_idx
+    ON orders (supply_date DESC, order_id DESC);
@@ -0,0 +1,4 @@
+-- Lets the "customer name contains" filter use an index instead of a full scan
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX IF NOT EXISTS orders_customer_name_trgm_idx
+    ON orders USING gin (customer_name gin_trgm_ops);
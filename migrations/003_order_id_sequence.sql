@@ -0,0 +1,9 @@
+-- Order IDs are allocated from a sequence instead of MAX(order_id) + 1
+CREATE SEQUENCE IF NOT EXISTS order_id_seq AS bigint;
+
+-- Seed it so the next allocated ID follows the highest existing numeric order_id
+SELECT setval(
+    'order_id_seq',
+    COALESCE((SELECT MAX(order_id::text::bigint) FROM orders WHERE order_id::text ~ '^[0-9]+$'), 0) + 1,
+    false
+);
@@ -0,0 +1,22 @@
+-- Tell every app process when reference data changes so cached copies are dropped
+CREATE OR REPLACE FUNCTION notify_catalog_changed() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('catalog_changed', TG_TABLE_NAME);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS customers_catalog_changed ON customers;
+CREATE TRIGGER customers_catalog_changed
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON customers
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_catalog_changed();
+
+DROP TRIGGER IF EXISTS items_catalog_changed ON items;
+CREATE TRIGGER items_catalog_changed
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON items
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_catalog_changed();
+
+DROP TRIGGER IF EXISTS customer_prompts_catalog_changed ON customer_prompts;
+CREATE TRIGGER customer_prompts_catalog_changed
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON customer_prompts
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_catalog_changed();
@@ -0,0 +1,11 @@
+-- Extra names a customer is known by, used by the local customer resolver
+CREATE TABLE IF NOT EXISTS customer_aliases (
+    customer_id TEXT NOT NULL,
+    alias TEXT NOT NULL,
+    PRIMARY KEY (customer_id, alias)
+);
+
+DROP TRIGGER IF EXISTS customer_aliases_catalog_changed ON customer_aliases;
+CREATE TRIGGER customer_aliases_catalog_changed
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON customer_aliases
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_catalog_changed();
@@ -0,0 +1,10 @@
+-- Extra WhatsApp/phone numbers registered per customer, stored normalized (e.g. 972501234567)
+CREATE TABLE IF NOT EXISTS customer_phones (
+    phone TEXT PRIMARY KEY,
+    customer_id TEXT NOT NULL
+);
+
+DROP TRIGGER IF EXISTS customer_phones_catalog_changed ON customer_phones;
+CREATE TRIGGER customer_phones_catalog_changed
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON customer_phones
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_catalog_changed();
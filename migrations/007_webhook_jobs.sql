@@ -0,0 +1,21 @@
+-- Durable queue of incoming WhatsApp messages, drained by the workers in jobs.py
+CREATE TABLE IF NOT EXISTS webhook_jobs (
+    id BIGSERIAL PRIMARY KEY,
+    message_sid TEXT,
+    from_number TEXT,
+    to_number TEXT,
+    body TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',  -- pending, running, done, failed
+    attempts INTEGER NOT NULL DEFAULT 0,
+    run_after TIMESTAMPTZ NOT NULL DEFAULT now(),
+    locked_at TIMESTAMPTZ,
+    last_error TEXT,
+    result TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    finished_at TIMESTAMPTZ
+);
+
+-- Workers only ever scan jobs that are waiting or in flight
+CREATE INDEX IF NOT EXISTS webhook_jobs_claim_idx
+    ON webhook_jobs (run_after, id)
+    WHERE status IN ('pending', 'running');
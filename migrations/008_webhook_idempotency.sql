@@ -0,0 +1,10 @@
+-- Idempotency keys for incoming webhooks: "sid:<MessageSid>" for Twilio retries and
+-- "body:<hash of sender + normalized text>" for resubmissions of the same message
+CREATE TABLE IF NOT EXISTS webhook_message_keys (
+    key TEXT PRIMARY KEY,
+    job_id BIGINT NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+-- Order ID a job allocated, recorded before its lines are inserted so a re-run cannot insert them twice
+ALTER TABLE webhook_jobs ADD COLUMN IF NOT EXISTS order_id TEXT;
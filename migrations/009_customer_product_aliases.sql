@@ -0,0 +1,14 @@
+-- Phrases a customer uses for a product, learned from orders confirmed in the app
+CREATE TABLE IF NOT EXISTS customer_product_aliases (
+    customer_id TEXT NOT NULL,
+    alias TEXT NOT NULL,  -- normalized phrase
+    product_id TEXT NOT NULL,
+    uses INTEGER NOT NULL DEFAULT 1,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (customer_id, alias)
+);
+
+DROP TRIGGER IF EXISTS customer_product_aliases_catalog_changed ON customer_product_aliases;
+CREATE TRIGGER customer_product_aliases_catalog_changed
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON customer_product_aliases
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_catalog_changed();
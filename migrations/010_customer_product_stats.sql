@@ -0,0 +1,102 @@
+-- What each customer orders: the source of the order form's recommendations
+CREATE TABLE IF NOT EXISTS customer_product_stats (
+    customer_id TEXT NOT NULL,
+    product_id TEXT NOT NULL,
+    last_order_date DATE,
+    order_count INTEGER NOT NULL,  -- distinct orders containing the product
+    typical_quantity NUMERIC,  -- median quantity per order line; non-numeric quantities are skipped
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (customer_id, product_id)
+);
+
+-- Recomputing a (customer, product) pair only reads that pair's order lines
+CREATE INDEX IF NOT EXISTS orders_customer_product_idx
+    ON orders ((customer_id::text), (product_id::text));
+
+-- Recompute the stats of the given (customer, product) pairs from their order lines
+CREATE OR REPLACE FUNCTION refresh_customer_product_stats(customer_ids TEXT[], product_ids TEXT[]) RETURNS void AS $$
+    WITH pairs AS (
+        SELECT DISTINCT customer_id, product_id
+        FROM unnest(customer_ids, product_ids) AS p(customer_id, product_id)
+        WHERE customer_id IS NOT NULL AND product_id IS NOT NULL
+    ), stats AS (
+        SELECT p.customer_id, p.product_id,
+               MAX(CASE WHEN o.supply_date::text ~ '^\d{4}-\d{2}-\d{2}'
+                        THEN left(o.supply_date::text, 10)::date END) AS last_order_date,
+               COUNT(DISTINCT o.order_id) AS order_count,
+               percentile_cont(0.5) WITHIN GROUP (
+                   ORDER BY CASE WHEN o.quantity::text ~ '^\s*-?[0-9]+(\.[0-9]+)?\s*$'
+                                 THEN o.quantity::text::numeric END
+               ) AS typical_quantity
+        FROM pairs p
+        JOIN orders o ON o.customer_id::text = p.customer_id AND o.product_id::text = p.product_id
+        GROUP BY p.customer_id, p.product_id
+    ), removed AS (
+        -- Pairs whose last order line was deleted
+        DELETE FROM customer_product_stats s
+        USING pairs p
+        WHERE s.customer_id = p.customer_id AND s.product_id = p.product_id
+          AND NOT EXISTS (SELECT 1 FROM stats WHERE stats.customer_id = p.customer_id AND stats.product_id = p.product_id)
+    )
+    INSERT INTO customer_product_stats (customer_id, product_id, last_order_date, order_count, typical_quantity)
+    SELECT customer_id, product_id, last_order_date, order_count, typical_quantity
+    FROM stats
+    ON CONFLICT (customer_id, product_id) DO UPDATE
+    SET last_order_date = EXCLUDED.last_order_date,
+        order_count = EXCLUDED.order_count,
+        typical_quantity = EXCLUDED.typical_quantity,
+        updated_at = now();
+$$ LANGUAGE sql;
+
+-- Once per statement, for the pairs the statement touched
+CREATE OR REPLACE FUNCTION orders_refresh_customer_product_stats() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM refresh_customer_product_stats(array_agg(customer_id::text), array_agg(product_id::text))
+        FROM new_rows;
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM refresh_customer_product_stats(array_agg(customer_id::text), array_agg(product_id::text))
+        FROM old_rows;
+    ELSE
+        PERFORM refresh_customer_product_stats(array_agg(customer_id), array_agg(product_id))
+        FROM (
+            SELECT customer_id::text, product_id::text FROM new_rows
+            UNION
+            SELECT customer_id::text, product_id::text FROM old_rows
+        ) changed;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION orders_truncate_customer_product_stats() RETURNS trigger AS $$
+BEGIN
+    TRUNCATE customer_product_stats;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Triggers with transition tables take a single event each
+DROP TRIGGER IF EXISTS orders_stats_insert ON orders;
+CREATE TRIGGER orders_stats_insert
+    AFTER INSERT ON orders REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION orders_refresh_customer_product_stats();
+
+DROP TRIGGER IF EXISTS orders_stats_update ON orders;
+CREATE TRIGGER orders_stats_update
+    AFTER UPDATE ON orders REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION orders_refresh_customer_product_stats();
+
+DROP TRIGGER IF EXISTS orders_stats_delete ON orders;
+CREATE TRIGGER orders_stats_delete
+    AFTER DELETE ON orders REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION orders_refresh_customer_product_stats();
+
+DROP TRIGGER IF EXISTS orders_stats_truncate ON orders;
+CREATE TRIGGER orders_stats_truncate
+    AFTER TRUNCATE ON orders
+    FOR EACH STATEMENT EXECUTE FUNCTION orders_truncate_customer_product_stats();
+
+-- Backfill from the existing orders
+SELECT refresh_customer_product_stats(array_agg(customer_id), array_agg(product_id))
+FROM (SELECT DISTINCT customer_id::text, product_id::text FROM orders) existing;
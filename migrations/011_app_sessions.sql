@@ -0,0 +1,10 @@
+-- Logged-in app sessions; the browser only holds the random session ID in a cookie
+CREATE TABLE IF NOT EXISTS app_sessions (
+    id_hash TEXT PRIMARY KEY,  -- HMAC of the session ID under SESSION_SECRET
+    name TEXT,
+    email TEXT NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    expires_at TIMESTAMPTZ NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS app_sessions_expires_at_idx ON app_sessions (expires_at);
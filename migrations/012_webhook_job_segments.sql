@@ -0,0 +1,3 @@
+-- How a multi-branch message was split, recorded on the first attempt so retries
+-- map the stored order IDs onto the same segments even if the catalog changed since
+ALTER TABLE webhook_jobs ADD COLUMN IF NOT EXISTS segments JSONB;
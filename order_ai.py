@@ -0,0 +1,250 @@
+import os
+import json
+from datetime import datetime
+
+import pandas as pd
+import llm
+import catalog
+from prompts import get_parse_prompt, parse_messages
+from order_rules import get_rule_parser
+from json_stream import iter_json_records
+from customer_resolver import get_resolver
+from product_resolver import PRODUCT_MIN_SCORE, get_product_resolver
+
+
+# Model cascades, cheapest first; a tier's answer is used only if it validates
+CLASSIFY_MODELS = [m.strip() for m in os.getenv("LLM_CLASSIFY_MODELS", "gpt-4o-mini,gpt-4o").split(",") if m.strip()]
+PARSE_MODELS = [m.strip() for m in os.getenv("LLM_PARSE_MODELS", "gpt-4o-mini,gpt-4").split(",") if m.strip()]
+
+# Try the deterministic grammar in order_rules before any model call
+RULE_PARSER_ENABLED = os.getenv("RULE_PARSER_ENABLED", "1") != "0"
+
+
+def _classification_prompt(customer_json):
+    return f"""
+    You are a supervisor of AI agents. Your mission is to understand from the user input which company it is related to
+    and to send it to the correct AI agent expert. You do this by returning only the exact customer_id as number from the following list:
+    {customer_json}
+    If you are unsure or can't determine the company, respond with "unknown".
+    """
+
+
+def get_customer_from_input(user_input):
+    """Return the customer_id the message belongs to, or "unknown".
+
+    A local trigram match over customer names and aliases settles most
+    messages without a network call. Only ambiguous ones go to the LLM,
+    and then with just the short candidate list.
+    """
+    resolution = get_resolver().resolve(user_input)
+    if resolution.customer_id is not None:
+        return resolution.customer_id
+
+    if resolution.candidates:
+        customer_json = [
+            {"customer_id": c.customer_id, "customer_name": c.customer_name} for c in resolution.candidates
+        ]
+    else:
+        # Nothing looks like a customer name; let the model see the whole list
+        customer_json = catalog.get_customers()[["customer_id", "customer_name"]].to_dict('records')
+
+    messages = [
+        {"role": "system", "content": _classification_prompt(customer_json)},
+        {"role": "user", "content": user_input},
+    ]
+    known_ids = {str(c["customer_id"]) for c in customer_json}
+
+    # A small model's answer stands only if it names one of the offered customers
+    response = llm.cascade(
+        "classify",
+        CLASSIFY_MODELS,
+        lambda model: llm.complete(messages, model=model).strip(),
+        lambda answer: answer in known_ids,
+    )
+    return response
+
+
+def parse_order(input_text, customer_id, customer_prompts, min_score=PRODUCT_MIN_SCORE):
+    """Parse the order into JSON records, locally when the message fits the rule grammar, else with OpenAI.
+
+    ``min_score`` is the fuzzy product match a phrase needs; callers that
+    save orders unreviewed pass PRODUCT_UNREVIEWED_SCORE.
+    """
+    if RULE_PARSER_ENABLED:
+        records = get_rule_parser().parse(input_text, customer_id)
+        if records is not None:
+            return json.dumps(records, ensure_ascii=False)
+
+    # Stable prefix (instructions, then the customer's prompt) first, so repeat calls hit the prompt cache
+    compiled = get_parse_prompt(customer_id, customer_prompts)
+    messages = parse_messages(compiled, input_text)
+
+    def extract(model):
+        # The model extracts (phrase, quantity, date); product IDs are resolved locally
+        response = llm.complete(messages, model=model, temperature=0.0, prompt_version=compiled.version)
+        records = [resolve_order_line(record, customer_id, min_score) for record in iter_json_records([response])]
+        return json.dumps(records, ensure_ascii=False)
+
+    # Start with the small model and escalate when its answer does not validate
+    return llm.cascade(
+        "parse",
+        PARSE_MODELS,
+        extract,
+        lambda response: _is_valid_order(response, customer_id),
+    )
+
+
+def resolve_order_line(record, customer_id, min_score=PRODUCT_MIN_SCORE):
+    """Turn an extracted {phrase, quantity, supply_date} record into an order line with a catalog product_id.
+
+    An exact name or customer alias for the phrase wins. Otherwise a
+    product_id the model copied from the customer's instructions is kept,
+    if it exists in the catalog, since those instructions can assign IDs in
+    ways no alias captures. Only then is the phrase matched fuzzily, at
+    ``min_score``. Raises ValueError, naming the closest products, when none
+    of these settles the product.
+    """
+    if not isinstance(record, dict):
+        raise ValueError("Unexpected response format. Expected a list of dictionaries.")
+    phrase = record.get("phrase") or record.get("product_name")
+    resolver = get_product_resolver()
+    given = record.get("product_id")
+    given = str(given) if given is not None and str(given) in catalog.get_index("items", "product_id") else None
+
+    product_id = resolver.exact_match(phrase, customer_id) if phrase else None
+    candidates = []
+    if product_id is None:
+        product_id = given
+    if product_id is None and phrase:
+        product_id, candidates = resolver.resolve(phrase, customer_id, min_score)
+    if product_id is None:
+        hint = ", ".join(f"{c.product_name} ({c.product_id})" for c in candidates[:3])
+        raise ValueError(f"Could not match '{phrase}' to a product" + (f"; closest: {hint}" if hint else "."))
+    line = {
+        "customer_id": str(customer_id),
+        "product_id": product_id,
+        "quantity": record.get("quantity"),
+        "phrase": phrase,
+    }
+    if record.get("supply_date"):
+        line["supply_date"] = record["supply_date"]
+    return line
+
+
+def parse_order_stream(input_text, customer_id, customer_prompts, on_restart=None):
+    """Like parse_order, but yield each validated order line (a one-row DataFrame) as soon as the model writes it.
+
+    A malformed or invalid line aborts the stream at once. On a smaller
+    model it escalates to the next one, after ``on_restart()`` tells the
+    caller to drop the lines it already showed. On the last model the
+    ValueError is raised.
+    """
+    if RULE_PARSER_ENABLED:
+        records = get_rule_parser().parse(input_text, customer_id)
+        if records is not None:
+            for record in records:
+                yield parsed_order_to_dataframe(record)
+            return
+
+    compiled = get_parse_prompt(customer_id, customer_prompts)
+    messages = parse_messages(compiled, input_text)
+
+    def lines(model):
+        chunks = llm.stream(messages, model=model, temperature=0.0, prompt_version=compiled.version)
+        count = 0
+        try:
+            for record in iter_json_records(chunks):
+                df = parsed_order_to_dataframe(resolve_order_line(record, customer_id))
+                check_order_lines(df, customer_id)
+                count += 1
+                yield df
+        finally:
+            chunks.close()
+        if count == 0:
+            raise ValueError("The AI response contains no order lines.")
+
+    yield from llm.cascade_stream("parse", PARSE_MODELS, lines, on_restart)
+
+
+def check_order_lines(df, customer_id):
+    """Raise ValueError unless every line is for ``customer_id`` with a positive quantity."""
+    wrong_customer = df.loc[df["customer_id"] != str(customer_id), "customer_id"]
+    if not wrong_customer.empty:
+        raise ValueError(f"The AI response is for customer {wrong_customer.iloc[0]}, not {customer_id}.")
+    quantities = pd.to_numeric(df["quantity"], errors="coerce")
+    if not (quantities.notna().all() and (quantities > 0).all()):
+        raise ValueError("The AI response contains a missing or non-positive quantity.")
+
+
+def _is_valid_order(response, customer_id):
+    # Valid JSON with known products, the right customer and positive quantities
+    try:
+        check_order_lines(parsed_order_to_dataframe(response), customer_id)
+    except (ValueError, TypeError):
+        return False
+    return True
+
+
+def flatten_dict(d, parent_key='', sep='_'):
+    """Flatten a nested dictionary."""
+    items = []
+    for k, v in d.items():
+        new_key = f"{parent_key}{sep}{k}" if parent_key else k
+        if isinstance(v, dict):
+            items.extend(flatten_dict(v, new_key, sep=sep).items())
+        else:
+            items.append((new_key, v))
+    return dict(items)
+
+
+def parsed_order_to_dataframe(result):
+    """Turn a parse_order result into order lines ready for review or insert.
+
+    Names are mapped from the catalog, so the model only has to get the IDs
+    right. Raises ValueError when the result is malformed or references
+    unknown IDs. order_id is left empty; it is allocated when the order is saved.
+    """
+    if isinstance(result, str):
+        try:
+            result = json.loads(result)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"The AI response is not valid JSON: {e}")
+
+    # Flatten the dictionary and convert to DataFrame
+    if isinstance(result, list):  # Handle multiple products
+        df = pd.DataFrame([flatten_dict(item) for item in result])
+    elif isinstance(result, dict):  # Handle a single product
+        df = pd.DataFrame([flatten_dict(result)])
+    else:
+        raise ValueError("Unexpected response format. Expected a dictionary or list of dictionaries.")
+    if df.empty:
+        raise ValueError("The AI response contains no order lines.")
+    missing = [col for col in ("customer_id", "product_id", "quantity") if col not in df.columns]
+    if missing:
+        raise ValueError(f"The AI response is missing: {', '.join(missing)}")
+
+    # Format dates
+    today = datetime.now().strftime('%Y-%m-%d')
+    if "supply_date" not in df.columns:
+        df["supply_date"] = today
+    df["supply_date"] = pd.to_datetime(df["supply_date"].fillna(today)).dt.strftime('%Y-%m-%d')
+    df["created_at"] = datetime.now().isoformat()
+
+    # Convert necessary fields to strings
+    df["product_id"] = df["product_id"].astype(str)
+    df["customer_id"] = df["customer_id"].astype(str)
+
+    # Map customer_name and product_name through the cached catalog indexes
+    customer_index = catalog.get_index("customers", "customer_id")
+    item_index = catalog.get_index("items", "product_id")
+    unknown_ids = (
+        [f"customer_id {x}" for x in customer_index.unknown(df["customer_id"])]
+        + [f"product_id {x}" for x in item_index.unknown(df["product_id"])]
+    )
+    if unknown_ids:
+        raise ValueError(f"The AI response references unknown IDs: {', '.join(unknown_ids)}")
+    df["customer_name"] = customer_index.map(df["customer_id"], "customer_name")
+    df["product_name"] = item_index.map(df["product_id"], "product_name")
+
+    df["order_id"] = None
+    return df
@@ -0,0 +1,97 @@
+import os
+import re
+import asyncio
+from collections import namedtuple
+
+import pandas as pd
+import catalog
+from customer_resolver import get_resolver
+from order_ai import get_customer_from_input, parse_order, parsed_order_to_dataframe
+from product_resolver import PRODUCT_MIN_SCORE
+
+# How many segments are classified and parsed at the same time
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", os.getenv("LLM_MAX_CONCURRENCY", "8")))
+
+Segment = namedtuple("Segment", ["index", "text", "customer_id"])
+SegmentError = namedtuple("SegmentError", ["index", "text", "error"])
+
+_BLANK_LINES = re.compile(r"\n\s*\n")
+
+
+def split_segments(text):
+    """Split pasted input into per-customer segments.
+
+    Messages are separated by blank lines, and a message is split again at
+    every line that names a different customer ("Cafe Gan: ...", "Bistro: ...").
+    A block that names no customer at all continues the previous one.
+    Segments whose customer is named outright carry its customer_id.
+    """
+    resolver = get_resolver()
+    segments = []  # [customer_id or None, [lines]]
+    for block in _BLANK_LINES.split(text.strip()):
+        block = block.strip()
+        if not block:
+            continue
+        resolution = resolver.resolve(block)
+        if segments and resolution.customer_id is None and not resolution.candidates:
+            segments[-1][1].append(block)
+            continue
+        current = None
+        for line in block.splitlines():
+            customer_id = resolver.resolve(line).customer_id if line.strip() else None
+            if current is None or (customer_id is not None and customer_id != current[0] and current[0] is not None):
+                current = [customer_id, [line]]
+                segments.append(current)
+                continue
+            if current[0] is None:
+                current[0] = customer_id
+            current[1].append(line)
+    return [
+        Segment(i, "\n".join(lines).strip(), customer_id)
+        for i, (customer_id, lines) in enumerate(segments)
+    ]
+
+
+def parse_segment(segment, min_score=PRODUCT_MIN_SCORE):
+    """Classify (unless already known) and parse one segment into order lines."""
+    customer_id = segment.customer_id or get_customer_from_input(segment.text)
+    if customer_id == "unknown":
+        raise ValueError("Customer ID could not be determined.")
+    result = parse_order(segment.text, customer_id, catalog.get_customer_prompt(customer_id), min_score)
+    df = parsed_order_to_dataframe(result)
+    df["segment"] = segment.index
+    return df
+
+
+async def _parse_segments(segments, concurrency, min_score):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(segment):
+        async with semaphore:
+            try:
+                return await asyncio.to_thread(parse_segment, segment, min_score)
+            except Exception as e:
+                return SegmentError(segment.index, segment.text, str(e))
+
+    return await asyncio.gather(*(run(segment) for segment in segments))
+
+
+def parse_batch(text, concurrency=BATCH_CONCURRENCY):
+    """Parse many orders at once and return (lines DataFrame, list of SegmentError).
+
+    Segments are classified and parsed concurrently, at most ``concurrency``
+    at a time, so a batch takes about as long as its slowest segment. Each
+    line carries the index of its segment; a segment becomes one order.
+    """
+    return parse_segments(split_segments(text), concurrency)
+
+
+def parse_segments(segments, concurrency=BATCH_CONCURRENCY, min_score=PRODUCT_MIN_SCORE):
+    """Parse already split segments concurrently; return (lines DataFrame, list of SegmentError)."""
+    if not segments:
+        return pd.DataFrame(), []
+    results = asyncio.run(_parse_segments(segments, concurrency, min_score))
+    frames = [r for r in results if isinstance(r, pd.DataFrame)]
+    errors = [r for r in results if isinstance(r, SegmentError)]
+    df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    return df, errors
@@ -0,0 +1,278 @@
+import re
+from datetime import date, datetime, timedelta
+
+import catalog
+from customer_resolver import normalize
+
+WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+
+# Hebrew day names and their one-letter forms (ג' = Tuesday), as weekday() numbers
+HEBREW_WEEKDAYS = {
+    "ראשון": 6, "שני": 0, "שלישי": 1, "רביעי": 2, "חמישי": 3, "שישי": 4, "שבת": 5,
+    "א": 6, "ב": 0, "ג": 1, "ד": 2, "ה": 3, "ו": 4, "ש": 5,
+}
+
+_HEBREW_DAY = re.compile(
+    r"(?:^|(?<=\s))[לב]?-?יום\s+(ראשון|שני|שלישי|רביעי|חמישי|שישי|שבת|[אבגדהוש]['׳])(?=[\s,.!;]|$)"
+)
+_ENGLISH_DAY = re.compile(r"\b(?:(?:for|on|next)\s+)?(" + "|".join(WEEKDAYS) + r")\b", re.IGNORECASE)
+_RELATIVE_DAY = re.compile(
+    r"(?:^|(?<=\s))(?:ל|ב)?(היום|מחרתיים|מחר)(?=[\s,.!;]|$)|\b(?:for\s+)?(today|tomorrow)\b", re.IGNORECASE
+)
+_RELATIVE_OFFSETS = {"היום": 0, "today": 0, "מחר": 1, "tomorrow": 1, "מחרתיים": 2}
+_ISO_DATE = re.compile(r"\b(\d{4})-(\d{1,2})-(\d{1,2})\b")
+# 5/3, 5/3/25 and 5.3.2025 (day first); a bare 2.5 is a quantity, not a date
+_DAY_MONTH = re.compile(r"(?<![\d./])(\d{1,2})(?:/(\d{1,2})(?:/(\d{2}|\d{4}))?|\.(\d{1,2})\.(\d{2}|\d{4}))(?![\d./])")
+
+_SEGMENT_SPLIT = re.compile(r"[,\n;]+|\s+ו-?(?=\d)|\s+and\s+", re.IGNORECASE)
+_UNIT = r"(?:\s*(?:x|×|יח['׳]?|יחידות|units?|pcs))?"
+_QTY = r"(\d+(?:\.\d+)?)"
+_QTY_FIRST = re.compile(rf"^\s*(?:x\s*)?{_QTY}{_UNIT}\s+(.+?)\s*$", re.IGNORECASE)
+_QTY_LAST = re.compile(rf"^\s*(.+?)\s*[-:x×]?\s*{_QTY}{_UNIT}\s*$", re.IGNORECASE)
+_FILLER = re.compile(r"(?:^|(?<=\s))(בבקשה|תודה|please|thanks)(?=[\s,.!;]|$)", re.IGNORECASE)
+_GREETING = re.compile(
+    r"(?:^|(?<=\s))(היי|הי|שלום|בוקר טוב|ערב טוב|צהריים טובים|הזמנה|hi|hello|hey|good morning|order)(?=[\s,.!;:]|$)",
+    re.IGNORECASE,
+)
+# Letters that normalize() folds, so a normalized name can be found again in the raw message
+_FOLDED_LETTERS = {"כ": "[כך]", "מ": "[מם]", "נ": "[נן]", "פ": "[פף]", "צ": "[צץ]"}
+_HEBREW_PREFIX = "[והבלמשכ]{0,2}"
+
+# Customer prompts that set units or quantity rules ("מגש = 12 יחידות"); only the LLM applies those
+_UNIT_CONVENTION = re.compile(
+    r"יחיד|ארגז|קרטון|מגש|חביל|שקית|תריסר|כמות|מארז|\b(?:units?|box(?:es)?|cases?|trays?|packs?|dozens?|quantit\w*)\b",
+    re.IGNORECASE,
+)
+
+# Words linking a name to a product ID in customer prompts ("לחם כפרי = 2001")
+_ALIAS_NOISE = {"product", "id", "product id", "מקט", "מק ט", "is", "הוא", "זה"}
+_QUOTED = re.compile(r"[\"'“”‘’]([^\"'“”‘’]{2,40})[\"'“”‘’]")
+_ALIAS_CLAUSE_SPLIT = re.compile(r"[\n;,]+")
+
+
+def get_next_weekday(weekday_name, today=None):
+    """Get the next occurrence of the specified weekday."""
+    today = today or datetime.now()
+    target_day = WEEKDAYS.index(weekday_name.lower())
+    days_ahead = (target_day - today.weekday() + 7) % 7
+    return today + timedelta(days=days_ahead if days_ahead > 0 else 7)
+
+
+def _weekday_date(weekday, today):
+    return get_next_weekday(WEEKDAYS[weekday], today)
+
+
+def _day_month_date(day, month, year, today):
+    if year is None:
+        year = today.year
+        candidate = date(year, month, day)
+        # "5/1" sent in late December means next January
+        if (today - candidate).days > 180:
+            candidate = date(year + 1, month, day)
+        return candidate
+    if year < 100:
+        year += 2000
+    return date(year, month, day)
+
+
+def extract_supply_date(text, today=None):
+    """Find the supply date in a message and return (date or None, text without it).
+
+    Returns (False, text) when the message names more than one different date.
+    """
+    today = today or date.today()
+    if isinstance(today, datetime):
+        today = today.date()
+    found = set()
+
+    def take(pattern, to_date):
+        nonlocal text
+        def repl(match):
+            try:
+                found.add(to_date(match))
+            except ValueError:  # e.g. 31/2
+                found.add(None)
+            return " "
+        text = pattern.sub(repl, text)
+
+    take(_ISO_DATE, lambda m: date(int(m.group(1)), int(m.group(2)), int(m.group(3))))
+    take(_DAY_MONTH, lambda m: _day_month_date(
+        int(m.group(1)),
+        int(m.group(2) or m.group(4)),
+        int(m.group(3) or m.group(5)) if (m.group(3) or m.group(5)) else None,
+        today,
+    ))
+    take(_RELATIVE_DAY, lambda m: today + timedelta(days=_RELATIVE_OFFSETS[(m.group(1) or m.group(2)).lower()]))
+    take(_HEBREW_DAY, lambda m: _weekday_date(HEBREW_WEEKDAYS[m.group(1).rstrip("'׳")], today))
+    take(_ENGLISH_DAY, lambda m: _weekday_date(WEEKDAYS.index(m.group(1).lower()), today))
+
+    if None in found or len(found) > 1:
+        return False, text
+    return (found.pop() if found else None), text
+
+
+def mention_patterns(name):
+    """Regexes for a customer name opening or closing a raw message ("קפה גן: ...", "... לקפה גן").
+
+    They match despite case, final letters, punctuation and a Hebrew prefix.
+    A name inside the order lines is left alone, since it may be part of a
+    product name.
+    """
+    words = normalize(name).split()
+    if not words:
+        return None
+    body = r"[\W_]+".join("".join(_FOLDED_LETTERS.get(ch, re.escape(ch)) for ch in word) for word in words)
+    return (
+        re.compile(rf"^[\W_]*{_HEBREW_PREFIX}{body}(?=[\W_]|$)[ \t]*:?", re.IGNORECASE),
+        re.compile(rf"(?:^|(?<=[\W_])){_HEBREW_PREFIX}{body}[\W_]*$", re.IGNORECASE),
+    )
+
+
+def defines_units(prompt):
+    """Whether a customer prompt sets its own units or quantity rules."""
+    if not prompt or prompt != prompt:  # None or NaN
+        return False
+    return bool(_UNIT_CONVENTION.search(str(prompt)))
+
+
+def aliases_from_prompt(prompt, product_ids):
+    """Product aliases stated in a customer prompt, e.g. 'לחם כפרי = 2001' or '"חלות" -> 3002'.
+
+    Only clauses naming exactly one known product ID are used. Quoted text is
+    taken as the alias; otherwise the rest of the clause is, minus linking words.
+    """
+    aliases = {}
+    if not prompt or prompt != prompt:  # None or NaN
+        return aliases
+    for clause in _ALIAS_CLAUSE_SPLIT.split(str(prompt)):
+        ids = [token for token in re.findall(r"\d+", clause) if token in product_ids]
+        if len(set(ids)) != 1:
+            continue
+        quoted = _QUOTED.findall(clause)
+        names = quoted or [re.sub(rf"(?<!\d){ids[0]}(?!\d)", " ", clause)]
+        for name in names:
+            norm = normalize(name)
+            for noise in sorted(_ALIAS_NOISE, key=len, reverse=True):
+                norm = re.sub(rf"(?:^| ){re.escape(noise)}(?= |$)", " ", norm)
+            norm = " ".join(norm.split())
+            if norm and len(norm) <= 40 and not norm.isdigit():
+                aliases[norm] = ids[0]
+    return aliases
+
+
+class RuleParser:
+    """Deterministic parser for the usual "20 לחם כפרי, 10 חלות ליום שלישי" orders.
+
+    Products are matched exactly, after normalization, against item names,
+    foreign names and the aliases in each customer's prompt. Anything the
+    grammar does not cover makes ``parse`` return None, so the caller can
+    fall back to the LLM. The customer's own name or alias and greetings
+    are dropped first, since most messages start with them. Customers
+    whose prompt defines units are always left to the LLM.
+    """
+
+    def __init__(self, customers_df, items_df, prompts_df=None, aliases_df=None):
+        self.customer_names = dict(zip(customers_df["customer_id"].astype(str), customers_df["customer_name"]))
+        names = list(self.customer_names.items())
+        if aliases_df is not None and not aliases_df.empty:
+            names += list(zip(aliases_df["customer_id"].astype(str), aliases_df["alias"]))
+        self.mentions = {}
+        for customer_id, name in names:
+            if name is None or name != name:
+                continue
+            patterns = mention_patterns(name)
+            if patterns is not None:
+                self.mentions.setdefault(customer_id, []).append((len(normalize(name)), patterns))
+        # Longest names first, so "קפה גן רמת אביב" goes before "קפה גן"
+        self.mentions = {
+            customer_id: [patterns for _, patterns in sorted(found, key=lambda item: item[0], reverse=True)]
+            for customer_id, found in self.mentions.items()
+        }
+        self.product_names = dict(zip(items_df["product_id"].astype(str), items_df["product_name"]))
+        self.aliases = {}
+        ambiguous = set()
+        name_columns = [col for col in ("product_name", "ForignName") if col in items_df.columns]
+        for col in name_columns:
+            for product_id, name in zip(items_df["product_id"].astype(str), items_df[col]):
+                if name is None or name != name:
+                    continue
+                norm = normalize(name)
+                if not norm:
+                    continue
+                if self.aliases.get(norm, product_id) != product_id:
+                    ambiguous.add(norm)
+                self.aliases[norm] = product_id
+        for norm in ambiguous:
+            del self.aliases[norm]
+
+        self.customer_aliases = {}
+        self.unit_customers = set()
+        if prompts_df is not None and not prompts_df.empty:
+            product_ids = set(self.product_names)
+            for customer_id, prompt in zip(prompts_df["customer_id"].astype(str), prompts_df["open_ai_prompt"]):
+                self.customer_aliases[customer_id] = aliases_from_prompt(prompt, product_ids)
+                if defines_units(prompt):
+                    self.unit_customers.add(customer_id)
+
+    def _product(self, phrase, customer_aliases):
+        norm = normalize(phrase)
+        return customer_aliases.get(norm) or self.aliases.get(norm)
+
+    def _without_mention(self, text, customer_id):
+        # Greetings go first, so "היי, הזמנה לקפה גן: ..." starts with the name
+        text = _GREETING.sub(" ", _FILLER.sub(" ", text))
+        for opening, closing in self.mentions.get(customer_id, ()):
+            stripped = closing.sub(" ", opening.sub(" ", text, count=1), count=1)
+            if stripped != text:
+                return stripped
+        return text
+
+    def _line(self, segment, customer_aliases):
+        for pattern, qty_group, product_group in ((_QTY_FIRST, 1, 2), (_QTY_LAST, 2, 1)):
+            match = pattern.match(segment)
+            if match:
+                product_id = self._product(match.group(product_group), customer_aliases)
+                if product_id is not None:
+                    quantity = float(match.group(qty_group))
+                    return product_id, int(quantity) if quantity.is_integer() else quantity
+        return None
+
+    def parse(self, text, customer_id, today=None):
+        """Return order records like parse_order's JSON, or None when the message does not fit the grammar."""
+        customer_id = str(customer_id)
+        if customer_id not in self.customer_names or customer_id in self.unit_customers:
+            return None
+        text = self._without_mention(text, customer_id)
+        today = today or date.today()
+        supply_date, rest = extract_supply_date(text, today)
+        if supply_date is False:
+            return None
+        if supply_date is None:
+            supply_date = today.date() if isinstance(today, datetime) else today
+
+        customer_aliases = self.customer_aliases.get(customer_id, {})
+        records = []
+        for segment in _SEGMENT_SPLIT.split(rest):
+            if not segment.strip(" .!-:"):
+                continue
+            line = self._line(segment.strip(" .!:"), customer_aliases)
+            if line is None or line[1] <= 0:
+                return None
+            product_id, quantity = line
+            records.append({
+                "order_id": str(len(records) + 1),
+                "customer_name": self.customer_names[customer_id],
+                "customer_id": customer_id,
+                "product_id": product_id,
+                "product_name": self.product_names[product_id],
+                "quantity": quantity,
+                "supply_date": supply_date.isoformat(),
+            })
+        return records or None
+
+
+def get_rule_parser():
+    """Rule parser over the cached catalog, rebuilt when customers, items, prompts or aliases change."""
+    return catalog.derived(
+        "rule_parser", ("customers", "items", "customer_prompts", "customer_aliases"), RuleParser
+    )
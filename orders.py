@@ -0,0 +1,264 @@
+from collections import namedtuple
+
+import pandas as pd
+from psycopg2.extras import execute_values
+from db import get_connection, fetch_data_from_postgres, fetch_one, timed
+from exports import copy_csv, copy_xml
+
+# Number of orders (not order lines) shown per page of the orders grid
+ORDERS_PAGE_SIZE = 50
+
+# Keyset pagination: pick the next page of (supply_date, order_id) keys from the
+# index, then fetch every line of those orders. Newest supply dates come first.
+ORDERS_PAGE_QUERY = """
+WITH page AS (
+    SELECT DISTINCT supply_date, order_id
+    FROM orders
+    WHERE supply_date IS NOT NULL AND order_id IS NOT NULL {after}
+    ORDER BY supply_date DESC, order_id DESC
+    LIMIT %s
+)
+SELECT o.*
+FROM orders o
+JOIN page USING (supply_date, order_id)
+ORDER BY o.supply_date DESC, o.order_id DESC;
+"""
+
+# Lines with a NULL key cannot be keyset-paged, so they follow the keyed pages
+NULL_KEYS_EXIST_QUERY = "SELECT EXISTS (SELECT 1 FROM orders WHERE supply_date IS NULL OR order_id IS NULL);"
+NULL_KEYS_PAGE_QUERY = """
+SELECT *
+FROM orders
+WHERE supply_date IS NULL OR order_id IS NULL
+ORDER BY supply_date DESC NULLS LAST, order_id DESC NULLS LAST
+LIMIT %s OFFSET %s;
+"""
+
+# Page key of the trailing pages that hold lines without a supply_date or order_id
+NullKeysPage = namedtuple("NullKeysPage", ["offset"])
+
+
+def _fetch_rows(query, params):
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            with timed(query):
+                cur.execute(query, params)
+            columns = [desc[0] for desc in cur.description]
+            rows = cur.fetchall()
+        conn.rollback()
+    return columns, rows
+
+
+def _fetch_null_keys_page(offset, page_size):
+    columns, rows = _fetch_rows(NULL_KEYS_PAGE_QUERY, [page_size + 1, offset])
+    next_key = NullKeysPage(offset + page_size) if len(rows) > page_size else None
+    return pd.DataFrame(rows[:page_size], columns=columns), next_key
+
+
+def fetch_orders_page(after=None, page_size=ORDERS_PAGE_SIZE):
+    """Fetch one page of orders older than the ``after`` (supply_date, order_id) key.
+
+    Returns ``(page_df, next_key)``; ``next_key`` is None on the last page.
+    Lines missing either key come last, ``page_size`` lines per page.
+    """
+    if isinstance(after, NullKeysPage):
+        return _fetch_null_keys_page(after.offset, page_size)
+    if after is None:
+        condition, params = "", []
+    else:
+        condition, params = "AND (supply_date, order_id) < (%s, %s)", list(after)
+    query = ORDERS_PAGE_QUERY.format(after=condition)
+
+    # Ask for one extra order so we know whether another page exists
+    columns, rows = _fetch_rows(query, params + [page_size + 1])
+
+    key_idx = (columns.index("supply_date"), columns.index("order_id"))
+    keys = []
+    for row in rows:
+        key = (row[key_idx[0]], row[key_idx[1]])
+        if not keys or keys[-1] != key:
+            keys.append(key)
+
+    next_key = None
+    if len(keys) > page_size:
+        extra = keys[page_size]
+        rows = [row for row in rows if (row[key_idx[0]], row[key_idx[1]]) != extra]
+        next_key = keys[page_size - 1]
+    elif fetch_one(NULL_KEYS_EXIST_QUERY)[0]:
+        if not rows:
+            return _fetch_null_keys_page(0, page_size)
+        next_key = NullKeysPage(0)
+
+    return pd.DataFrame(rows, columns=columns), next_key
+
+
+def estimate_orders_count():
+    """Cheap row estimate for the orders table from the planner statistics."""
+    row = fetch_one("SELECT reltuples::bigint FROM pg_class WHERE oid = 'orders'::regclass;")
+    estimate = row[0] if row else -1
+    if estimate < 0:
+        # Table was never analyzed, so it is small enough to count exactly
+        estimate = fetch_one("SELECT COUNT(*) FROM orders;")[0]
+    return int(estimate)
+
+
+# Filtered orders for the exploration page, with the static doctype column the ERP export expects
+FILTERED_ORDERS_QUERY = """
+SELECT *, 11 AS doctype
+FROM orders
+{where}
+ORDER BY supply_date DESC, order_id DESC;
+"""
+
+# Rows shown in the filtered preview; the exports always cover every matching row
+FILTER_PREVIEW_ROWS = 500
+
+# Per-product quantity sum; non-numeric quantities count as 0
+SUM_BY_PRODUCT_QUERY = r"""
+SELECT product_id, product_name,
+       SUM(CASE WHEN quantity::text ~ '^\s*-?[0-9]+(\.[0-9]+)?\s*$'
+                THEN quantity::text::numeric ELSE 0 END) AS quantity
+FROM orders
+{where}
+GROUP BY product_id, product_name
+ORDER BY quantity DESC;
+"""
+
+# created_at as 'YYYY-MM-DD HH:MM:SS' text, compared as a string rather than cast, so a
+# malformed value is NULL and left out of the filter instead of failing the whole query
+CREATED_AT_TEXT = (
+    r"rpad(replace(substring(created_at::text from '^(\d{4}-\d{2}-\d{2}(?:[ T]\d{2}:\d{2}:\d{2})?)'), "
+    r"'T', ' '), 19, ' 00:00:00')"
+)
+CREATED_AT_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def _escape_like(value):
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def build_orders_filter(customer_name=None, supply_date=None, created_from=None, created_to=None):
+    """Compile the orders page filters into a ``(where_sql, params)`` pair.
+
+    ``supply_date`` is a date; ``created_from``/``created_to`` are datetimes.
+    """
+    clauses, params = [], []
+    if customer_name:
+        clauses.append("customer_name ILIKE %s")
+        params.append(f"%{_escape_like(customer_name)}%")
+    if supply_date:
+        # Passed as an untyped literal so it matches date and text columns alike
+        clauses.append("supply_date = %s")
+        params.append(supply_date.isoformat())
+    if created_from:
+        clauses.append(f"{CREATED_AT_TEXT} >= %s")
+        params.append(created_from.strftime(CREATED_AT_FORMAT))
+    if created_to:
+        clauses.append(f"{CREATED_AT_TEXT} <= %s")
+        params.append(created_to.strftime(CREATED_AT_FORMAT))
+    where = "WHERE " + " AND ".join(clauses) if clauses else ""
+    return where, params
+
+
+def fetch_filtered_orders(where="", params=None, limit=None):
+    """Fetch the order lines matching a filter from build_orders_filter, at most ``limit`` of them."""
+    query = FILTERED_ORDERS_QUERY.format(where=where)
+    params = list(params or [])
+    if limit is not None:
+        query = query.rstrip().rstrip(";") + "\nLIMIT %s;"
+        params.append(limit)
+    return fetch_data_from_postgres(query, params or None)
+
+
+def fetch_sum_by_product(where="", params=None):
+    """Total ordered quantity per product for the order lines matching a filter."""
+    df = fetch_data_from_postgres(SUM_BY_PRODUCT_QUERY.format(where=where), params or None)
+    df["quantity"] = pd.to_numeric(df["quantity"])
+    return df
+
+
+def export_filtered_orders_csv(where="", params=None):
+    """CSV export (file object) of the order lines matching a filter, via COPY."""
+    return copy_csv(FILTERED_ORDERS_QUERY.format(where=where), params or None)
+
+
+def export_sum_by_product_csv(where="", params=None):
+    """CSV export (file object) of the per-product quantity sums, via COPY."""
+    return copy_csv(SUM_BY_PRODUCT_QUERY.format(where=where), params or None)
+
+
+def export_filtered_orders_xml(where="", params=None):
+    """XML export (file object) of the order lines matching a filter, streamed from a cursor."""
+    return copy_xml(FILTERED_ORDERS_QUERY.format(where=where), params or None)
+
+
+# Column order used when writing order lines
+ORDER_COLUMNS = [
+    "order_id", "customer_name", "customer_id", "product_id",
+    "product_name", "quantity", "supply_date", "created_at",
+]
+
+INSERT_ORDER_LINES_QUERY = f"INSERT INTO orders ({', '.join(ORDER_COLUMNS)}) VALUES %s;"
+
+
+def insert_order_lines(rows):
+    """Insert order lines (sequences in ORDER_COLUMNS order) in a single statement and transaction."""
+    rows = list(rows)
+    if not rows:
+        return 0
+    with get_connection() as conn:
+        try:
+            with conn.cursor() as cur:
+                with timed(INSERT_ORDER_LINES_QUERY):
+                    # One page holding every line, so the whole order is one round trip
+                    execute_values(cur, INSERT_ORDER_LINES_QUERY, rows, page_size=len(rows))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return len(rows)
+
+
+def insert_order_lines_once(order_id, rows):
+    """Insert the lines of order ``order_id`` unless that order already exists; return whether they were inserted.
+
+    The check and the insert run in one transaction under a lock on the order
+    ID, so two runs of the same job can never both insert it.
+    """
+    rows = list(rows)
+    with get_connection() as conn:
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s));", (f"order:{order_id}",))
+                cur.execute("SELECT 1 FROM orders WHERE order_id = %s LIMIT 1;", (str(order_id),))
+                if cur.fetchone() is not None:
+                    conn.rollback()
+                    return False
+                if rows:
+                    with timed(INSERT_ORDER_LINES_QUERY):
+                        execute_values(cur, INSERT_ORDER_LINES_QUERY, rows, page_size=len(rows))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return True
+
+
+def order_lines_from_dataframe(df):
+    """Turn a DataFrame with the ORDER_COLUMNS into rows of plain Python values."""
+    return df[ORDER_COLUMNS].astype(object).values.tolist()
+
+
+def allocate_order_id():
+    """Allocate a new, unique order ID from the order_id_seq sequence."""
+    return fetch_one("SELECT nextval('order_id_seq');")[0]
+
+
+def allocate_order_ids(count):
+    """Allocate ``count`` order IDs from order_id_seq in one round trip."""
+    if count <= 0:
+        return []
+    df = fetch_data_from_postgres(
+        "SELECT nextval('order_id_seq') AS order_id FROM generate_series(1, %s);", (count,)
+    )
+    return df["order_id"].tolist()
@@ -0,0 +1,74 @@
+import os
+import builtins
+import threading
+from collections import OrderedDict, namedtuple
+
+# Directory holding the page scripts shown in the sidebar
+PAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pages")
+DEFAULT_PAGE = "All Pages"
+
+Page = namedtuple("Page", ["title", "path"])
+
+
+def page_title(filename):
+    """'create_order.py' -> 'Create Order'."""
+    return filename[:-len(".py")].replace("_", " ").title()
+
+
+class PageRegistry:
+    """The page scripts in ``pages_dir``, discovered once per process.
+
+    Each page is compiled on first use and its code object is reused on
+    every rerun; a page is recompiled only when its file changes. Pages run
+    in a fresh namespace, so their globals never mix with the runner's.
+    """
+
+    def __init__(self, pages_dir=PAGES_DIR):
+        self.pages_dir = pages_dir
+        filenames = sorted(os.listdir(pages_dir)) if os.path.isdir(pages_dir) else []
+        self.pages = OrderedDict(
+            (page_title(f), Page(page_title(f), os.path.join(pages_dir, f)))
+            for f in filenames if f.endswith(".py")
+        )
+        self._code = {}  # path -> (mtime_ns, code object)
+        self._lock = threading.Lock()
+
+    def titles(self):
+        return list(self.pages)
+
+    def default_index(self, default=DEFAULT_PAGE):
+        titles = self.titles()
+        return titles.index(default) if default in titles else 0
+
+    def code(self, title):
+        """The compiled code of a page, compiling it only if it is new or changed."""
+        path = self.pages[title].path
+        mtime = os.stat(path).st_mtime_ns
+        cached = self._code.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        with self._lock:
+            with open(path, encoding="utf-8") as f:
+                code = compile(f.read(), path, "exec")
+            self._code[path] = (mtime, code)
+        return code
+
+    def run(self, title):
+        """Run a page script the way ``streamlit run`` would, in its own namespace."""
+        path = self.pages[title].path
+        namespace = {"__name__": "__main__", "__file__": path, "__builtins__": builtins}
+        exec(self.code(title), namespace)
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """Return the process-wide page registry, discovering the pages on first use."""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = PageRegistry()
+    return _registry
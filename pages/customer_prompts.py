@@ -1,46 +1,17 @@
 import streamlit as st
-import pandas as pd
-import psycopg2
-import os
-from dotenv import load_dotenv
-
-# Load environment variables
-load_dotenv()
-
-# PostgreSQL database connection details
-DATABASE_URL = os.environ.get("DATABASE_URL")
-
-# Function to connect to PostgreSQL and fetch data
-def fetch_data_from_postgres(query):
-    conn = psycopg2.connect(DATABASE_URL, sslmode="require")
-    df = pd.read_sql_query(query, conn)
-    conn.close()
-    return df
-
-# Function to execute a query in PostgreSQL
-def execute_query(query, params=None):
-    conn = psycopg2.connect(DATABASE_URL, sslmode="require")
-    cursor = conn.cursor()
-    cursor.execute(query, params)
-    conn.commit()
-    cursor.close()
-    conn.close()
-
-# Fetch customers data
-@st.cache_data
+from db import execute_query
+import catalog
+
+# Fetch customers data from the shared reference-data cache
 def get_customers():
-    query = "SELECT customer_id, customer_name FROM customers;"
-    return fetch_data_from_postgres(query)
+    return catalog.get_customers()[["customer_id", "customer_name"]]
 
 # Fetch customer prompts data with customer names
-@st.cache_data
 def get_customer_prompts():
-    query = """
-    SELECT cp.customer_id, c.customer_name, cp.open_ai_prompt
-    FROM customer_prompts cp
-    LEFT JOIN customers c ON cp.customer_id = c.customer_id;
-    """
-    return fetch_data_from_postgres(query)
+    prompts = catalog.get_customer_prompts()[["customer_id", "open_ai_prompt"]]
+    return prompts.merge(get_customers(), on="customer_id", how="left")[
+        ["customer_id", "customer_name", "open_ai_prompt"]
+    ]
 
 # Main Streamlit app
 def main():
@@ -48,7 +19,7 @@ def main():
 
     # Button to refresh data
     if st.button("Refresh Data"):
-        st.cache_data.clear()
+        catalog.invalidate()
 
     # Fetch customers data
     customers = get_customers()
@@ -96,6 +67,7 @@ def main():
                 VALUES (%s, %s);
                 """
                 execute_query(insert_query, (selected_customer["customer_id"], open_ai_prompt))
+                catalog.invalidate("customer_prompts")
                 st.success("Prompt added successfully!")
             else:
                 st.error("Prompt cannot be empty.")
@@ -133,6 +105,7 @@ def main():
                     WHERE customer_id = %s AND open_ai_prompt = %s;
                     """
                     execute_query(update_query, (updated_prompt, selected_prompt['customer_id'], selected_prompt['open_ai_prompt']))
+                    catalog.invalidate("customer_prompts")
                     st.success("Prompt updated successfully!")
         else:
             st.write("No prompts available for the selected customer.")
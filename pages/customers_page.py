@@ -1,43 +1,23 @@
 import streamlit as st
 import pandas as pd
-import psycopg2
-import os
-from dotenv import load_dotenv
-
-# Load environment variables
-load_dotenv()
-
-# PostgreSQL database connection details
-DATABASE_URL = os.environ.get("DATABASE_URL")
-
-# Function to connect to PostgreSQL and fetch data
-def fetch_data_from_postgres(query):
-    conn = psycopg2.connect(DATABASE_URL, sslmode="require")
-    df = pd.read_sql_query(query, conn)
-    conn.close()
-    return df
+import db
+import catalog
+from customer_resolver import normalize_phone
 
 # Function to execute INSERT/DELETE queries
 def execute_query(query, params=None):
-    conn = psycopg2.connect(DATABASE_URL, sslmode="require")
-    cursor = conn.cursor()
     try:
-        cursor.execute(query, params)
-        conn.commit()
+        db.execute_query(query, params)
     except Exception as e:
         st.error(f"An error occurred: {e}")
-    finally:
-        cursor.close()
-        conn.close()
 
-# Fetch customers table
-query = """
-    SELECT "ID", "customer_id", "customer_name", "SortGroup", "Address", 
-           "City", "Zip", "Country", "Phone", "Fax"
-    FROM customers;
-"""
+# Columns shown on this page
+CUSTOMER_COLUMNS = ["ID", "customer_id", "customer_name", "SortGroup", "Address",
+                    "City", "Zip", "Country", "Phone", "Fax"]
+
+# Fetch customers table from the shared reference-data cache
 try:
-    customers_df = fetch_data_from_postgres(query)
+    customers_df = catalog.get_customers()[CUSTOMER_COLUMNS]
 except Exception as e:
     st.error(f"An error occurred while fetching data: {e}")
     customers_df = pd.DataFrame()  # Empty DataFrame in case of error
@@ -80,6 +60,7 @@ with st.form("add_customer_form"):
                 phone or None, fax or None
             )
             execute_query(add_query, params)
+            catalog.invalidate("customers")
             st.success(f"Customer {customer_name} added successfully!")
         else:
             st.warning("Please fill out the required fields: Customer ID and Customer Name.")
@@ -101,6 +82,7 @@ if not customers_df.empty:
     if st.button("Delete Customer"):
         delete_query = "DELETE FROM customers WHERE customer_id = %s;"
         execute_query(delete_query, (selected_customer['customer_id'],))
+        catalog.invalidate("customers")
         st.success(f"Customer {selected_customer['display_name']} deleted successfully!")
         
         # Refresh the page by clearing session state and using query parameters
@@ -111,10 +93,59 @@ if not customers_df.empty:
 else:
     st.write("No customers available for deletion.")
 
+# Customer Aliases (extra names used to recognise the customer in order messages)
+st.subheader("Customer Aliases")
+if not customers_df.empty:
+    with st.form("add_alias_form"):
+        alias_customer = st.selectbox(
+            "Customer",
+            customers_df.to_dict('records'),
+            format_func=lambda x: x['display_name'],
+        )
+        alias = st.text_input("Alias * (Required)")
+        if st.form_submit_button("Add Alias"):
+            if alias.strip():
+                add_alias_query = """
+                    INSERT INTO customer_aliases (customer_id, alias)
+                    VALUES (%s, %s)
+                    ON CONFLICT DO NOTHING;
+                """
+                execute_query(add_alias_query, (str(alias_customer['customer_id']), alias.strip()))
+                catalog.invalidate("customer_aliases")
+                st.success(f"Alias '{alias.strip()}' added for {alias_customer['display_name']}.")
+            else:
+                st.warning("Please enter an alias.")
+
+# Registered WhatsApp numbers (messages from these numbers skip customer classification)
+st.subheader("Registered Phone Numbers")
+if not customers_df.empty:
+    with st.form("add_phone_form"):
+        phone_customer = st.selectbox(
+            "Customer",
+            customers_df.to_dict('records'),
+            format_func=lambda x: x['display_name'],
+            key="phone_customer",
+        )
+        phone_number = st.text_input("Phone Number * (Required)")
+        if st.form_submit_button("Register Number"):
+            normalized_phone = normalize_phone(phone_number)
+            if normalized_phone:
+                add_phone_query = """
+                    INSERT INTO customer_phones (phone, customer_id)
+                    VALUES (%s, %s)
+                    ON CONFLICT (phone) DO UPDATE SET customer_id = EXCLUDED.customer_id;
+                """
+                execute_query(add_phone_query, (normalized_phone, str(phone_customer['customer_id'])))
+                catalog.invalidate("customer_phones")
+                st.success(f"Number {normalized_phone} registered for {phone_customer['display_name']}.")
+            else:
+                st.warning("Please enter a valid phone number.")
+
 # Refresh Customers Table
 if st.button("Refresh Data"):
     try:
-        customers_df = fetch_data_from_postgres(query)
+        catalog.invalidate("customers")
+        customers_df = catalog.get_customers()[CUSTOMER_COLUMNS]
         if not customers_df.empty:
             st.dataframe(customers_df)
         else:
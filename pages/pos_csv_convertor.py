@@ -1,7 +1,7 @@
 import streamlit as st
 import pandas as pd
-import xml.etree.ElementTree as ET
 from io import BytesIO
+from exports import iter_dataframe_xml
 
 # Streamlit app
 st.title("POS Excel to XML")
@@ -47,39 +47,15 @@ if uploaded_file:
         st.write("### Transformed DataFrame:")
         st.dataframe(new_df)
 
-        # Create XML structure
-        root = ET.Element("Data")
-        for _, row in new_df.iterrows():
-            item = ET.SubElement(root, "Item")
-
-            reference = ET.SubElement(item, "Reference")
-            reference.text = str(row["reference"])
-
-            account_id = ET.SubElement(item, "AccountID")
-            account_id.text = str(row["account_id"])
-
-            item_id = ET.SubElement(item, "ItemID")
-            item_id.text = str(row["item_id"])
-
-            item_name = ET.SubElement(item, "ItemName")
-            item_name.text = str(row["item_name"])
-
-            quantity = ET.SubElement(item, "Quantity")
-            quantity.text = str(row["quantity"])
-
-            amount = ET.SubElement(item, "Amount")
-            amount.text = str(row["amount"])
-
-            doc_type = ET.SubElement(item, "DocType")
-            doc_type.text = str(row["doc_type"])
-
-        # Convert XML tree to string
-        xml_str = ET.tostring(root, encoding='unicode')
+        # Stream the XML straight into the download buffer, one chunk of <Item> elements at a time
+        xml_columns = ["reference", "account_id", "item_id", "item_name", "quantity", "amount", "doc_type"]
+        xml_tags = ["Reference", "AccountID", "ItemID", "ItemName", "Quantity", "Amount", "DocType"]
 
         # Download the XML file
         st.write("### Download the XML File:")
         xml_file = BytesIO()
-        xml_file.write(xml_str.encode('utf-8'))
+        for chunk in iter_dataframe_xml(new_df[xml_columns], root_tag="Data", tags=xml_tags):
+            xml_file.write(chunk)
         xml_file.seek(0)
 
         st.download_button(
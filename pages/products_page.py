@@ -1,43 +1,22 @@
 import streamlit as st
 import pandas as pd
-import psycopg2
-import os
-from dotenv import load_dotenv
-
-# Load environment variables
-load_dotenv()
-
-# PostgreSQL database connection details
-DATABASE_URL = os.environ.get("DATABASE_URL")
-
-# Function to connect to PostgreSQL and fetch data
-def fetch_data_from_postgres(query):
-    conn = psycopg2.connect(DATABASE_URL, sslmode="require")
-    df = pd.read_sql_query(query, conn)
-    conn.close()
-    return df
+import db
+import catalog
 
 # Function to execute INSERT/DELETE queries
 def execute_query(query, params=None):
-    conn = psycopg2.connect(DATABASE_URL, sslmode="require")
-    cursor = conn.cursor()
     try:
-        cursor.execute(query, params)
-        conn.commit()
+        db.execute_query(query, params)
     except Exception as e:
         st.error(f"An error occurred: {e}")
-    finally:
-        cursor.close()
-        conn.close()
 
-# Fetch items table
-query = """
-    SELECT "ID", "product_id", "product_name", "ForignName", "SortGroup", 
-           "Filter", "Price", "Currency", "PurchPrice", "PurchCurrency"
-    FROM items;
-"""
+# Columns shown on this page
+ITEM_COLUMNS = ["ID", "product_id", "product_name", "ForignName", "SortGroup",
+                "Filter", "Price", "Currency", "PurchPrice", "PurchCurrency"]
+
+# Fetch items table from the shared reference-data cache
 try:
-    items_df = fetch_data_from_postgres(query)
+    items_df = catalog.get_items()[ITEM_COLUMNS]
 except Exception as e:
     st.error(f"An error occurred while fetching data: {e}")
     items_df = pd.DataFrame()  # Empty DataFrame in case of error
@@ -85,6 +64,7 @@ with st.form("add_product_form"):
                 purch_currency or None,
             )
             execute_query(add_query, params)
+            catalog.invalidate("items")
             st.success(f"Product '{product_name}' added successfully!")
         else:
             st.warning("Please fill out the required fields: Product ID and Product Name.")
@@ -106,6 +86,7 @@ if not items_df.empty:
     if st.button("Delete Product"):
         delete_query = "DELETE FROM items WHERE product_id = %s;"
         execute_query(delete_query, (selected_product['product_id'],))
+        catalog.invalidate("items")
         st.success(f"Product {selected_product['display_name']} deleted successfully!")
 
         # Clear session state and refresh
@@ -119,7 +100,8 @@ else:
 # Refresh Items Table
 if st.button("Refresh Data"):
     try:
-        items_df = fetch_data_from_postgres(query)
+        catalog.invalidate("items")
+        items_df = catalog.get_items()[ITEM_COLUMNS]
         if not items_df.empty:
             st.dataframe(items_df)
         else:
@@ -1,120 +1,28 @@
 import streamlit as st
 import pandas as pd
 from datetime import date
-import xml.etree.ElementTree as ET
-import psycopg2
-import os
-from dotenv import load_dotenv
-load_dotenv()
-
-# PostgreSQL database connection details
-DATABASE_URL = os.environ.get("DATABASE_URL")
-
-def convert_to_csv(df):
-    # Use utf-8-sig encoding for Hebrew support in CSV
-    return df.to_csv(index=False, encoding="utf-8-sig").encode("utf-8-sig")
-
-def convert_to_xml(df):
-    root = ET.Element("Orders")
-    for _, row in df.iterrows():
-        item = ET.SubElement(root, "Item")
-        for col in df.columns:
-            ET.SubElement(item, col).text = str(row[col])
-    return ET.tostring(root, encoding="utf-8").decode("utf-8")
-
-# Function to connect to PostgreSQL and fetch data
-def fetch_data_from_postgres(query):
-    conn = psycopg2.connect(DATABASE_URL, sslmode="require")
-    df = pd.read_sql_query(query, conn)
-    conn.close()
-    return df
-
-def generate_html(df):
-    grouped = df.groupby("customer_name")
-    supply_date = df["supply_date"].iloc[0]
-    html_content = f"""
-    <!DOCTYPE html>
-    <html lang="he" dir="rtl">
-    <head>
-        <meta charset="UTF-8">
-        <title>תמצית הזמנות</title>
-        <style>
-            body {{
-                font-family: Arial, sans-serif;
-                margin: 20px;
-                direction: rtl;
-            }}
-            .container {{
-                display: grid;
-                grid-template-columns: 1fr 1fr 1fr;
-                gap: 20px;
-                page-break-inside: avoid;
-            }}
-            .column {{
-                border: 1px solid #ddd;
-                padding: 10px;
-                box-sizing: border-box;
-                page-break-inside: avoid;
-            }}
-            .order {{
-                margin-bottom: 15px;
-            }}
-            .order-title {{
-                font-size: 24px;
-                font-weight: bold;
-                margin-bottom: 10px;
-                direction: rtl;
-                unicode-bidi: isolate;
-            }}
-            .product {{
-                font-size: 18px;
-                margin-bottom: 5px;
-                direction: rtl;
-                unicode-bidi: isolate;
-            }}
-        </style>
-    </head>
-    <body>
-        <h1 style="text-align: center;">הזמנות לתאריך: {supply_date} </h1>
-        <div class="container">
-    """
-    for customer_name, group in grouped:
-        reshaped_order_id = f"שם לקוח: {customer_name}"
-        order_html = f"""
-        <div class="order">
-            <div class="order-title">{reshaped_order_id}</div>
-        """
-        for _, row in group.iterrows():
-            product_id = row.get("product_id", "Unknown Product ID")
-            product_name = row.get("product_name", "Unknown Product")
-            quantity = str(row.get("quantity", "Unknown Quantity"))
-            order_html += f"""
-            <div class="product">{product_id} {product_name}: {quantity}</div>
-            """
-        order_html += "</div>"
-        html_content += f'<div class="column">{order_html}</div>'
-    html_content += """
-        </div>
-    </body>
-    </html>
-    """
-    return html_content
+from components import orders_grid, filtered_orders_preview, export_downloads, production_sheet_pdf
+from production_sheet import render_html
+from orders import (
+    build_orders_filter,
+    fetch_filtered_orders,
+    fetch_sum_by_product,
+    export_filtered_orders_csv,
+    export_sum_by_product_csv,
+    export_filtered_orders_xml,
+)
 
 def data_exploration_page():
     st.title("Data Exploration and Export")
 
-    # Fetch orders data
-    orders_query = "SELECT * FROM orders;"
-    orders_df = fetch_data_from_postgres(orders_query)
+    # Display the orders one page at a time
+    st.header("Orders Data")
+    orders_df = orders_grid(key="view_orders_grid")
 
     if orders_df.empty:
         st.write("No data available to display.")
         return
 
-    # Display the dataframe
-    st.header("Orders Data")
-    st.dataframe(orders_df)
-
     # Filtering options
     st.subheader("Filter Data")
     customer_filter = st.text_input("Filter by Customer Name (contains)")
@@ -123,78 +31,55 @@ def data_exploration_page():
     created_at_start = st.text_input("Created At - Start Timestamp (YYYY-MM-DD HH:MM:SS)", value=None)
     created_at_end = st.text_input("Created At - End Timestamp (YYYY-MM-DD HH:MM:SS)", value=None)
 
-    filtered_df = orders_df.copy()
-
-    if customer_filter:
-        filtered_df = filtered_df[filtered_df["customer_name"].str.contains(customer_filter, case=False, na=False)]
-
-    if date_filter and "supply_date" in filtered_df.columns:
-        filtered_df["supply_date"] = pd.to_datetime(filtered_df["supply_date"], errors="coerce").dt.date
-        filtered_df = filtered_df[filtered_df["supply_date"] == date_filter]
-
-    if created_at_start or created_at_end and "created_at" in filtered_df.columns:
-        filtered_df["created_at"] = pd.to_datetime(filtered_df["created_at"], format="%Y-%m-%d %H:%M:%S", errors="coerce")
-        if created_at_start:
-            filtered_df = filtered_df[filtered_df["created_at"] >= pd.to_datetime(created_at_start)]
-        if created_at_end:
-            filtered_df = filtered_df[filtered_df["created_at"] <= pd.to_datetime(created_at_end)]
+    try:
+        created_from = pd.to_datetime(created_at_start).to_pydatetime() if created_at_start else None
+        created_to = pd.to_datetime(created_at_end).to_pydatetime() if created_at_end else None
+    except ValueError:
+        st.error("Created At timestamps must be in the format YYYY-MM-DD HH:MM:SS.")
+        return
 
-    # Add static column
-    filtered_df["doctype"] = 11
+    # Without a filter this would be the whole table; the grid above already pages through it
+    if not (customer_filter or date_filter or created_from or created_to):
+        st.info("Set at least one filter to preview, sum and export the matching orders.")
+        return
 
-    st.write(f"Filtered {len(filtered_df)} rows.")
-    st.dataframe(filtered_df)
+    # Filters and the static doctype column are applied in SQL
+    where, params = build_orders_filter(customer_filter, date_filter, created_from, created_to)
+    filtered_df = filtered_orders_preview(where, params)
 
     # Aggregation
     if "quantity" in filtered_df.columns:
-        filtered_df["quantity"] = pd.to_numeric(filtered_df["quantity"], errors="coerce").fillna(0)
-        sum_by_product = (
-            filtered_df.groupby(["product_id", "product_name"])["quantity"]
-            .sum()
-            .reset_index()
-            .sort_values(by="quantity", ascending=False)
-        )
+        sum_by_product = fetch_sum_by_product(where, params)
         st.write("Top Products by Quantity")
         st.dataframe(sum_by_product)
 
-            # Export the aggregated data
-        sum_csv_data = convert_to_csv(sum_by_product)
-        st.download_button(
-                label="Download Sum by Product as CSV",
-                data=sum_csv_data,
-                file_name="sum_by_product.csv",
-                mime="text/csv",
-            )
+        # Export the aggregated data with COPY, only when asked for
+        export_downloads(
+            [("Sum by Product as CSV", "sum_by_product.csv", "text/csv",
+              lambda: export_sum_by_product_csv(where, params))],
+            filter_key=(where, tuple(params)), key="view_orders_sum_export",
+        )
     else:
             st.write("The 'quantity' column is missing. Unable to calculate sum by product.")
 
     # Export options
     st.subheader("Export Data")
 
-    csv_data = convert_to_csv(filtered_df)
-    xml_data = convert_to_xml(filtered_df)
-    html_data = generate_html(filtered_df)
-
-    st.download_button(
-        label="Download as CSV",
-        data=csv_data,
-        file_name="filtered_orders.csv",
-        mime="text/csv",
-    )
-
-    st.download_button(
-        label="Download as XML",
-        data=xml_data,
-        file_name="filtered_orders.xml",
-        mime="application/xml",
+    # Each export scans every matching row, so it is only built on request
+    export_downloads(
+        [
+            ("as CSV", "filtered_orders.csv", "text/csv", lambda: export_filtered_orders_csv(where, params)),
+            ("as XML", "filtered_orders.xml", "application/xml", lambda: export_filtered_orders_xml(where, params)),
+            ("as HTML", "filtered_orders.html", "text/html", lambda: render_html(fetch_filtered_orders(where, params))),
+        ],
+        filter_key=(where, tuple(params)), key="view_orders_export",
     )
 
-    st.download_button(
-        label="Download as HTML",
-        data=html_data,
-        file_name="filtered_orders.html",
-        mime="text/html",
-    )
+    # Print-ready production sheet of the chosen supply date, rendered off the Streamlit thread on request
+    if date_filter and not filtered_df.empty:
+        production_sheet_pdf(
+            lambda: fetch_filtered_orders(where, params), date_filter.isoformat(), filter_key=(where, tuple(params))
+        )
 
 # Directly call the data exploration page
 data_exploration_page()
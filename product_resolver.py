@@ -0,0 +1,152 @@
+import os
+from collections import namedtuple
+
+import numpy as np
+from psycopg2.extras import execute_values
+
+import catalog
+from db import get_connection, timed
+from customer_resolver import normalize, trigrams
+from order_rules import aliases_from_prompt
+
+# A phrase resolves on its own when the best product scores at least this
+# much and beats the next product by the margin
+PRODUCT_MIN_SCORE = float(os.getenv("PRODUCT_MIN_SCORE", "0.6"))
+PRODUCT_MARGIN = float(os.getenv("PRODUCT_MARGIN", "0.1"))
+# Orders saved without a review step (the WhatsApp webhook) only take a
+# fuzzy match this close; "לחם" alone must not become a specific bread
+PRODUCT_UNREVIEWED_SCORE = float(os.getenv("PRODUCT_UNREVIEWED_SCORE", "0.9"))
+
+ProductMatch = namedtuple("ProductMatch", ["product_id", "product_name", "score"])
+
+LEARN_ALIASES_QUERY = """
+INSERT INTO customer_product_aliases (customer_id, alias, product_id)
+VALUES %s
+ON CONFLICT (customer_id, alias) DO UPDATE
+SET uses = CASE WHEN customer_product_aliases.product_id = EXCLUDED.product_id
+                THEN customer_product_aliases.uses + 1 ELSE 1 END,
+    product_id = EXCLUDED.product_id,
+    updated_at = now();
+"""
+
+
+class ProductResolver:
+    """Character-trigram index over product names, foreign names and per-customer aliases.
+
+    Every name is a row of an L2-normalized binary trigram matrix; a phrase
+    is scored against all rows with one matrix-vector product (cosine
+    similarity). Customer aliases, from customer prompts and from orders
+    confirmed in the app, only count for their own customer.
+    """
+
+    def __init__(self, items_df, prompts_df=None, learned_df=None):
+        self.product_names = dict(zip(items_df["product_id"].astype(str), items_df["product_name"]))
+        names = []  # (owner customer_id or None, normalized name, product_id)
+        for col in ("product_name", "ForignName"):
+            if col in items_df.columns:
+                names += [(None, name, product_id) for product_id, name in zip(self.product_names, items_df[col])]
+        if prompts_df is not None and not prompts_df.empty:
+            product_ids = set(self.product_names)
+            for customer_id, prompt in zip(prompts_df["customer_id"].astype(str), prompts_df["open_ai_prompt"]):
+                names += [(customer_id, alias, pid) for alias, pid in aliases_from_prompt(prompt, product_ids).items()]
+        if learned_df is not None and not learned_df.empty:
+            names += list(zip(learned_df["customer_id"].astype(str), learned_df["alias"], learned_df["product_id"].astype(str)))
+
+        self.exact = {}
+        rows = []
+        for owner, name, product_id in names:
+            if name is None or name != name or product_id not in self.product_names:
+                continue
+            norm = normalize(name)
+            if not norm:
+                continue
+            self.exact.setdefault((owner, norm), product_id)
+            rows.append((owner, norm, product_id))
+
+        self.vocabulary = {}
+        row_grams = []
+        for _, norm, _ in rows:
+            grams = trigrams(norm)
+            row_grams.append([self.vocabulary.setdefault(gram, len(self.vocabulary)) for gram in grams])
+        matrix = np.zeros((len(rows), max(len(self.vocabulary), 1)), dtype=np.float32)
+        for i, cols in enumerate(row_grams):
+            matrix[i, cols] = 1.0 / np.sqrt(len(cols))
+        self.matrix = matrix
+        self.owners = np.array([owner for owner, _, _ in rows], dtype=object)
+        self.row_products = np.array([product_id for _, _, product_id in rows], dtype=object)
+        self._masks = {}
+
+    def _mask(self, customer_id):
+        # Rows visible to a customer: global names plus that customer's aliases
+        mask = self._masks.get(customer_id)
+        if mask is None:
+            mask = (self.owners == None) | (self.owners == customer_id)  # noqa: E711
+            self._masks[customer_id] = mask
+        return mask
+
+    def top_k(self, phrase, customer_id=None, k=5):
+        """The ``k`` best-scoring products for a phrase, best first."""
+        norm = normalize(phrase)
+        if not norm or not len(self.matrix):
+            return []
+        customer_id = None if customer_id is None else str(customer_id)
+        grams = trigrams(norm)
+        cols = [self.vocabulary[gram] for gram in grams if gram in self.vocabulary]
+        if not cols:
+            return []
+        # Unknown trigrams still count in the phrase norm, so they lower the score
+        scores = self.matrix[:, cols].sum(axis=1) / np.sqrt(len(grams))
+        scores = np.where(self._mask(customer_id), scores, 0.0)
+
+        best = {}
+        for i in np.argsort(scores)[::-1]:
+            if scores[i] <= 0 or len(best) >= k:
+                break
+            best.setdefault(self.row_products[i], float(scores[i]))
+        return [ProductMatch(pid, self.product_names[pid], score) for pid, score in best.items()]
+
+    def exact_match(self, phrase, customer_id=None):
+        """The product a phrase names exactly (a product name or one of the customer's aliases), or None."""
+        norm = normalize(phrase)
+        customer_id = None if customer_id is None else str(customer_id)
+        return self.exact.get((customer_id, norm)) or self.exact.get((None, norm))
+
+    def resolve(self, phrase, customer_id=None, min_score=PRODUCT_MIN_SCORE):
+        """Return (product_id or None, candidates) for a phrase from an order."""
+        exact = self.exact_match(phrase, customer_id)
+        if exact is not None:
+            return exact, [ProductMatch(exact, self.product_names[exact], 1.0)]
+        candidates = self.top_k(phrase, customer_id)
+        if candidates and candidates[0].score >= min_score:
+            runner_up = candidates[1].score if len(candidates) > 1 else 0.0
+            if candidates[0].score - runner_up >= PRODUCT_MARGIN:
+                return candidates[0].product_id, candidates
+        return None, candidates
+
+
+def get_product_resolver():
+    """Resolver over the cached items, prompts and learned aliases, rebuilt when any of them changes."""
+    return catalog.derived(
+        "product_resolver", ("items", "customer_prompts", "customer_product_aliases"), ProductResolver
+    )
+
+
+def learn_product_aliases(rows):
+    """Remember confirmed (customer_id, phrase, product_id) matches as exact aliases for that customer."""
+    values = {}
+    for customer_id, phrase, product_id in rows:
+        alias = normalize(phrase) if phrase is not None and phrase == phrase else ""
+        if alias:
+            values[(str(customer_id), alias)] = str(product_id)
+    if not values:
+        return 0
+    with get_connection() as conn:
+        try:
+            with conn.cursor() as cur:
+                with timed(LEARN_ALIASES_QUERY):
+                    execute_values(cur, LEARN_ALIASES_QUERY, [(c, a, p) for (c, a), p in values.items()])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return len(values)
@@ -0,0 +1,152 @@
+import hashlib
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+from jinja2 import Environment
+
+# Number of rendered PDFs kept per process, keyed by (supply_date, data version)
+PDF_CACHE_SIZE = 32
+
+SHEET_TEMPLATE = """<!DOCTYPE html>
+<html lang="he" dir="rtl">
+<head>
+    <meta charset="UTF-8">
+    <title>תמצית הזמנות</title>
+    <style>
+        @page {
+            size: A4;
+            margin: 1cm;
+        }
+        body {
+            font-family: Arial, sans-serif;
+            margin: 20px;
+            direction: rtl;
+        }
+        .container {
+            display: grid;
+            grid-template-columns: 1fr 1fr 1fr;
+            gap: 20px;
+            page-break-inside: avoid;
+        }
+        .column {
+            border: 1px solid #ddd;
+            padding: 10px;
+            box-sizing: border-box;
+            page-break-inside: avoid;
+        }
+        .order {
+            margin-bottom: 15px;
+        }
+        .order-title {
+            font-size: 24px;
+            font-weight: bold;
+            margin-bottom: 10px;
+            direction: rtl;
+            unicode-bidi: isolate;
+        }
+        .product {
+            font-size: 18px;
+            margin-bottom: 5px;
+            direction: rtl;
+            unicode-bidi: isolate;
+        }
+    </style>
+</head>
+<body>
+    <h1 style="text-align: center;">{{ title }}</h1>
+    <div class="container">
+    {%- for customer_name, lines in blocks %}
+        <div class="column"><div class="order">
+            <div class="order-title">שם לקוח: {{ customer_name }}</div>
+            {%- for line in lines %}
+            <div class="product">{{ line }}</div>
+            {%- endfor %}
+        </div></div>
+    {%- endfor %}
+    </div>
+</body>
+</html>
+"""
+
+# Compiled once per process
+_template = Environment(autoescape=True).from_string(SHEET_TEMPLATE)
+
+
+def _column(df, name, default):
+    if name in df.columns:
+        return df[name].astype(str)
+    return pd.Series(default, index=df.index)
+
+
+def customer_blocks(df):
+    """Return ``[(customer_name, [product line, ...]), ...]`` sorted by customer name."""
+    if df.empty:
+        return []
+    lines = (
+        _column(df, "product_id", "Unknown Product ID") + " "
+        + _column(df, "product_name", "Unknown Product") + ": "
+        + _column(df, "quantity", "Unknown Quantity")
+    )
+    grouped = lines.groupby(df["customer_name"], sort=True).agg(list)
+    return list(grouped.items())
+
+
+def sheet_supply_date(df):
+    """The supply date shared by all lines, or "" if there is none or they span several dates."""
+    if df.empty or "supply_date" not in df.columns:
+        return ""
+    dates = df["supply_date"].astype(str).unique()
+    return dates[0] if len(dates) == 1 else ""
+
+
+def render_html(df, title=None):
+    """Render the production sheet (one block per customer) as an RTL HTML page."""
+    if title is None:
+        title = f"הזמנות לתאריך: {sheet_supply_date(df)} "
+    return _template.render(title=title, blocks=customer_blocks(df))
+
+
+def data_version(df):
+    """Content hash of the order lines, used to tell whether a cached sheet is still current."""
+    hashed = pd.util.hash_pandas_object(df, index=False).values
+    return hashlib.sha256(hashed.tobytes() + ",".join(map(str, df.columns)).encode("utf-8")).hexdigest()
+
+
+def _render_pdf(html):
+    # Runs in a worker process; weasyprint is only imported there
+    from weasyprint import HTML
+    return HTML(string=html).write_pdf()
+
+
+_executor = None
+_pdf_cache = OrderedDict()
+_pdf_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+
+def request_pdf(df, supply_date=None):
+    """Start (or reuse) the PDF rendering of a production sheet and return its Future.
+
+    Rendering happens in a worker process, so the caller never blocks on layout.
+    Results are cached by (supply_date, data version).
+    """
+    key = (supply_date or sheet_supply_date(df), data_version(df))
+    with _pdf_lock:
+        future = _pdf_cache.get(key)
+        if future is not None and not (future.done() and future.exception() is not None):
+            _pdf_cache.move_to_end(key)
+            return future
+        future = _get_executor().submit(_render_pdf, render_html(df))
+        _pdf_cache[key] = future
+        while len(_pdf_cache) > PDF_CACHE_SIZE:
+            _pdf_cache.popitem(last=False)
+    return future
@@ -0,0 +1,73 @@
+import json
+import hashlib
+from collections import namedtuple
+from datetime import datetime
+
+import catalog
+
+# Generic parsing instructions and output schema. Nothing here may depend on
+# the customer, the date or the message: this text opens every parse prompt,
+# so the provider can serve it from its prompt cache.
+PARSE_INSTRUCTIONS = """
+    you are AI agent that processes orders. you mission is receive order as it sent from the customer and to parse it to a valid JSON structure.
+    Return one JSON object per ordered product, with only these fields:
+    1. phrase: the product exactly as the customer wrote it (e.g. "לחם כפרי"). Do not translate it or map it to a product ID; we resolve it against our catalog.
+    2. quantity: the number of units ordered. Follow the specific instructions if they define units or quantities.
+    3. supply_date: If a date is mentioned, use it. If a day is mentioned (e.g., Monday), calculate the next occurrence of that day. If no date is provided, use today's date, which is given with the order.
+    4. product_id: only if the specific instructions explicitly assign a product ID to this phrase; otherwise leave it out.
+
+    Output JSON Example:
+[
+    {
+        "phrase": "לחם כפרי",
+        "quantity": 400,
+        "supply_date": "2025-01-16"
+    },
+    {
+        "phrase": "לחמניות",
+        "quantity": 80,
+        "supply_date": "2025-01-16"
+    }
+]
+    """
+
+# The stable part of a customer's parse prompt and a hash identifying it
+CompiledPrompt = namedtuple("CompiledPrompt", ["customer_id", "customer_prompt", "prefix", "version"])
+
+
+def compile_parse_prompt(customer_id, customer_prompt):
+    """Build the cacheable prefix: generic instructions first, then the customer's own instructions."""
+    prefix = (
+        {"role": "system", "content": PARSE_INSTRUCTIONS},
+        {"role": "user", "content": f"specific instruction: {customer_prompt}"},
+        {"role": "assistant", "content": "OK"},
+    )
+    version = hashlib.sha256(json.dumps(prefix, ensure_ascii=False).encode("utf-8")).hexdigest()[:12]
+    return CompiledPrompt(str(customer_id), customer_prompt, prefix, version)
+
+
+def compile_all(prompts_df):
+    """customer_id -> CompiledPrompt for every stored customer prompt."""
+    return {
+        str(customer_id): compile_parse_prompt(customer_id, prompt)
+        for customer_id, prompt in zip(prompts_df["customer_id"], prompts_df["open_ai_prompt"])
+    } if not prompts_df.empty else {}
+
+
+def get_parse_prompt(customer_id, customer_prompt):
+    """The precompiled prompt of a customer, recompiled only if the stored prompt changed."""
+    compiled = catalog.derived("parse_prompts", ("customer_prompts",), compile_all).get(str(customer_id))
+    if compiled is None or compiled.customer_prompt != customer_prompt:
+        compiled = compile_parse_prompt(customer_id, customer_prompt)
+    return compiled
+
+
+def parse_messages(compiled, input_text, now=None):
+    """The full message list: the compiled prefix, then the date, customer and message, which change per call."""
+    now = now or datetime.now()
+    volatile = (
+        f"today's date: {now.strftime('%Y-%m-%d')} ({now.strftime('%A')})\n"
+        f"customer_id: {compiled.customer_id}\n"
+        f"user input:{input_text}"
+    )
+    return list(compiled.prefix) + [{"role": "user", "content": volatile}]
@@ -0,0 +1,38 @@
+import os
+
+from db import fetch_data_from_postgres
+
+# How many products the order form recommends per customer
+RECOMMENDATION_LIMIT = int(os.getenv("RECOMMENDATION_LIMIT", "10"))
+# Days after which a product's order count weighs half as much in the ranking
+RECOMMENDATION_HALF_LIFE_DAYS = float(os.getenv("RECOMMENDATION_HALF_LIFE_DAYS", "14"))
+
+# Point lookup on the customer_product_stats primary key, kept current by
+# triggers on orders (migration 010). A product's score is its order count
+# decayed by how long ago it was last ordered, so a weekly staple outranks
+# a one-off from yesterday, and a product not ordered for months drops out.
+RECOMMENDATIONS_QUERY = """
+SELECT product_id, last_order_date, order_count, typical_quantity
+FROM customer_product_stats
+WHERE customer_id = %s
+ORDER BY COALESCE(
+             order_count * power(0.5, GREATEST(CURRENT_DATE - last_order_date, 0) / %s::numeric), 0
+         ) DESC,
+         last_order_date DESC NULLS LAST,
+         product_id
+LIMIT %s;
+"""
+
+
+def get_recommendations(customer_id, limit=RECOMMENDATION_LIMIT):
+    """The products a customer orders most, best first, with their typical quantity per order line."""
+    return fetch_data_from_postgres(
+        RECOMMENDATIONS_QUERY, (str(customer_id), RECOMMENDATION_HALF_LIFE_DAYS, limit)
+    )
+
+
+def usual_quantity(typical_quantity):
+    """A typical quantity as a whole number for the order form, or None if there is none."""
+    if typical_quantity is None or typical_quantity != typical_quantity:
+        return None
+    return max(1, int(round(float(typical_quantity))))
@@ -1,39 +1,42 @@
 import streamlit as st
-import os
-from google.oauth2 import id_token
-from google_auth_oauthlib.flow import Flow
-import google.auth.transport.requests
+import streamlit.components.v1 as components
 from dotenv import load_dotenv
-import base64
-import json
+import auth
+from page_registry import get_registry
 
 # Load .env file
 load_dotenv()
 
-# Retrieve and decode Google OAuth JSON credentials
-encoded_json = os.getenv("GOOGLE_CLIENT_SECRET_JSON")
-
-if not encoded_json:
-    raise ValueError("Error: GOOGLE_CLIENT_SECRET_JSON environment variable not found!")
-
-# Parse JSON credentials directly into a dictionary
-decoded_json = json.loads(base64.b64decode(encoded_json).decode("utf-8"))
-
-# Use credentials dictionary instead of a file
-flow = Flow.from_client_config(
-    decoded_json,
-    scopes=["openid", "https://www.googleapis.com/auth/userinfo.email", "https://www.googleapis.com/auth/userinfo.profile"],
-    redirect_uri="https://lehem-hakfar-orders-c410830785c4.herokuapp.com"
-)
+# Google OAuth client config, decoded once per process; both secrets must be set
+try:
+    auth.client_config()
+    auth.session_secret()
+except ValueError as e:
+    st.error(f"{e} Logins are disabled until it is set; .env.example lists the config vars the app needs.")
+    st.stop()
 
 # Initialize session state
 if "logged_in" not in st.session_state:
     st.session_state.logged_in = False
 
+# Write (or clear) the session cookie after a login or logout
+if "session_cookie" in st.session_state:
+    components.html(auth.cookie_script(st.session_state.pop("session_cookie")), height=0)
+
+# A reload carries the session cookie, so a live server-side session skips the OAuth round trip
+if not st.session_state.logged_in:
+    session_id = st.context.cookies.get(auth.SESSION_COOKIE)
+    user = auth.load_session(session_id)
+    if user:
+        st.session_state.logged_in = True
+        st.session_state.username = user["name"]
+        st.session_state.email = user["email"]
+        st.session_state.session_id = session_id
+
 st.title("Lehem Hakfar Orders")
 
 if not st.session_state.logged_in:
-    auth_url, _ = flow.authorization_url(prompt="consent")
+    auth_url, _ = auth.new_flow().authorization_url(prompt="consent")
     st.markdown(f'<a href="{auth_url}" target="_self"><button>Login with Google</button></a>', unsafe_allow_html=True)
 
     # Handle callback
@@ -45,18 +48,18 @@ if not st.session_state.logged_in:
             auth_code = query_params.get("code")
 
             if auth_code:
-                # Fetch token using the authorization code
-                flow.fetch_token(code=auth_code)
-
-                credentials = flow.credentials
-                request = google.auth.transport.requests.Request()
-                id_info = id_token.verify_oauth2_token(credentials.id_token, request)
+                # Fetch the token and verify it against Google's cached signing certificates
+                id_info = auth.login(auth_code)
 
                 # Store user details in session state
                 st.session_state.logged_in = True
                 st.session_state.username = id_info["name"]
                 st.session_state.email = id_info["email"]
 
+                # Start a server-side session; the browser only gets its random ID, in a cookie
+                st.session_state.session_id = auth.create_session(id_info.get("name"), id_info["email"])
+                st.session_state.session_cookie = st.session_state.session_id
+
                 # Clear query parameters after login
                 st.query_params.clear()
 
@@ -71,32 +74,22 @@ else:
     with st.sidebar:
         st.title(f"Welcome, {st.session_state.username}!")
         if st.button("Logout"):
+            # Ending the session server-side invalidates the cookie even if a copy survives
+            auth.end_session(st.session_state.pop("session_id", None))
+            st.session_state.session_cookie = None
             st.session_state.logged_in = False
             st.rerun()
 
-        # Show available pages
+        # Show available pages; discovered once per process, not on every rerun
         st.title("Navigation")
-        page_path = "pages"
-
-        if not os.path.exists(page_path):
-            os.makedirs(page_path)
-
-        pages = [f.replace(".py", "").replace("_", " ").title() for f in os.listdir(page_path) if f.endswith(".py")]
+        registry = get_registry()
+        pages = registry.titles()
+        selected_page = None
 
         if pages:
-            default_page = "All Pages"  # Set your default page name
-            if default_page in pages:
-                default_index = pages.index(default_page)
-            else:
-                default_index = 0  # Fallback to the first option if the default is missing
-
-            selected_page = st.selectbox("Select a Page", pages, index=default_index)
+            selected_page = st.selectbox("Select a Page", pages, index=registry.default_index())
 
     # Ensure the page content is rendered in the main area, not the sidebar
     if selected_page:
-        page_file = selected_page.lower().replace(" ", "_") + ".py"
-        file_path = os.path.join(page_path, page_file)
-
-        if os.path.exists(file_path):
-            exec(open(file_path).read())  # Execute the selected page in the main content area
+        registry.run(selected_page)  # Runs the page's cached compiled code
 
@@ -3,10 +3,16 @@ from flask import Flask, request, render_template, redirect, url_for, flash
 from dotenv import load_dotenv
 from twilio.twiml.messaging_response import MessagingResponse
 from twilio.rest import Client
-from openai import OpenAI
-import psycopg2
-import pandas as pd
-from datetime import date, datetime, timedelta
+import llm
+from catalog import get_customer_prompt
+from order_ai import get_customer_from_input, parse_order, parsed_order_to_dataframe
+from orders import allocate_order_id, allocate_order_ids, insert_order_lines_once, order_lines_from_dataframe
+from order_batch import Segment, parse_segments, split_segments
+from product_resolver import PRODUCT_UNREVIEWED_SCORE
+from customer_resolver import customer_for_sender
+from jobs import (
+    enqueue_message_once, job_status, set_job_order_id, set_job_order_ids, set_job_segments, start_workers
+)
 import logging  
 # Load environment variables from .env file
 
@@ -18,92 +24,8 @@ app = Flask(__name__)
 TWILIO_API_KEY = os.getenv("TWILIO_API_KEY")
 TWILIO_ACCOUNT = os.getenv("TWILIO_ACCOUNT")
 twillio_client = Client(TWILIO_ACCOUNT, TWILIO_API_KEY)
-DATABASE_URL = os.environ.get("DATABASE_URL")
-openai = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
-
-def fetch_data_from_postgres(query):
-    conn = psycopg2.connect(DATABASE_URL, sslmode="require")
-    df = pd.read_sql_query(query, conn)
-    conn.close()
-    return df
-
-def get_customer_from_input(client, user_input):
-    customers_query = "SELECT customer_id, customer_name FROM customers;"
-    customers_df = fetch_data_from_postgres(customers_query)    
-    customer_json = customers_df.to_dict('records')
-    prompt = f"""
-    You are a supervisor of AI agents. Your mission is to understand from the user input which company it is related to 
-    and to send it to the correct AI agent expert. You do this by returning only the exact customer_id as number from the following list:
-    {customer_json}
-    If you are unsure or can't determine the company, respond with "unknown".
-    """
-    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-    # Generate the response from OpenAI
-    completion = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[
-            {"role": "system", "content": prompt},
-            {"role": "user", "content": user_input},
-        ]
-    )
-
-    # Return the AI's response
-    return completion.choices[0].message.content.strip()
-
-def parse_order(input_text, customer_id, customer_prompts):
-    """Parse the order using OpenAI chat completion."""
-    today_date = datetime.now().strftime("%Y-%m-%d")
-    weekday = datetime.now().strftime("%A")
-
-    # Construct the prompt
-    system_prompt = f"""
-    you are AI agent that processes orders. you mission is receive order as it sent from the customer and to parse it to a valid JSON structure.
-    There are general instructions that you should follow:
-    1. Supply Date: If a date is mentioned, use it. If a day is mentioned (e.g., Monday), calculate the next occurrence of that day. If no date is provided, use today’s date which is {today_date}
-    2. Customer ID: {customer_id}
-    3. Customer Name: it doesnt matter what you return because we map the customer_id to the customer_name.
-    3. Product ID: you will receive it in specific instcructions.
-    4. Product Name: it doesnt matter what you return because we map the product_id to the product_name.
-    5. Quantity: you will receive it in specific instructions.
-    6. order_id: it doesnt matter what you return because we map the product id to the product name.
-    
-    Output JSON Example:
-    3. Example output for multiple products:
-[
-    {{
-        "order_id": "1",
-        "customer_name": "Customer A",
-        "customer_id": "1001",
-        "product_id": "2001",
-        "product_name": "Bread",
-        "quantity": 400,
-        "supply_date": "2025-01-16"
-    }},
-    {{
-        "order_id": "2",
-        "customer_name": "Customer A",
-        "customer_id": "1001",
-        "product_id": "2002",
-        "product_name": "Roll",
-        "quantity": 80,
-        "supply_date": "2025-01-16"
-    }}
-]
-    """
-    # Call OpenAI API
-    response = openai.chat.completions.create(model="gpt-4",
-    messages=[
-        {"role": "system", "content": system_prompt},
-        {"role": "user", "content":f"specific instruction: {customer_prompts}"},
-        {"role": "assistant", "content": "OK"},
-        {"role": "user", "content":f"user input:{input_text}"}
-    ]
-    ,temperature=0.0
-    )
-
-    # Extract and return the response
-    return response.choices[0].message.content
+# Open the LLM connection before the first message arrives
+llm.warm()
 
 
 @app.route('/')
@@ -117,8 +39,6 @@ def process_order():
         flash("OPENAI_API_KEY is not set. Please check your .env file.")
         return redirect(url_for('home'))
 
-    openai.api_key = openai_api_key
-
     # Log or print request.form for debugging purposes
     logging.debug(f"Received form data: {request.form}")
     print(request.form)  # This will now work because it's inside a request context.
@@ -128,14 +48,14 @@ def process_order():
         flash("Input is required.")
         return redirect(url_for('home'))
 
-    customer_key = get_customer_from_input(openai, user_input)
+    customer_key = get_customer_from_input(user_input)
 
     if customer_key == "unknown":
         flash("Unable to determine the customer from the provided input.")
         return redirect(url_for('home'))
 
     try:
-        response = parse_order(openai, customer_key, user_input)
+        response = parse_order(user_input, customer_key, get_customer_prompt(customer_key))
         flash(f"Data successfully written to Google Sheets! Updated {response} cells.")
     except ValueError as e:
         flash(f"Error processing AI response: {e}")
@@ -144,44 +64,147 @@ def process_order():
     
     return redirect(url_for('home'))
 
+
+def send_reply(job, message):
+    """Send a WhatsApp reply to the sender of a queued message."""
+    try:
+        twillio_client.messages.create(body=message, from_=job.to_number, to=job.from_number)
+    except Exception as e:
+        # The order is already saved; a failed reply must not re-run the job
+        logging.error(f"Could not send reply for job {job.id}: {e}")
+
+
+def process_message(job):
+    """Classify, parse and save one queued WhatsApp message, then reply to the sender.
+
+    A message that names several branches becomes one order per branch.
+    """
+    sender_customer = customer_for_sender(job.from_number)
+    segments = job_segments(job)
+    if len({segment.customer_id for segment in segments if segment.customer_id is not None}) > 1:
+        reply = process_branches(job, segments, sender_customer)
+    else:
+        reply = process_order_message(job, sender_customer)
+    send_reply(job, reply)
+    return reply
+
+
+def job_segments(job):
+    """The job's message split into per-customer segments, split on the first attempt and reused on retries.
+
+    A retry must map its stored order IDs onto the same segments, even if a
+    customer or alias changed in the catalog since the first attempt.
+    """
+    stored = job.segments
+    if stored is None:
+        split = [{"text": segment.text, "customer_id": segment.customer_id} for segment in split_segments(job.body)]
+        stored = set_job_segments(job.id, split)
+    return [Segment(index, segment["text"], segment["customer_id"]) for index, segment in enumerate(stored)]
+
+
+def process_order_message(job, sender_customer):
+    """Save a message that holds a single customer's order and return the reply."""
+    # Known senders map straight to their customer; only unknown ones need classification
+    customer_key = sender_customer or get_customer_from_input(job.body)
+
+    if customer_key == "unknown":
+        reply = "Sorry, we couldn't determine the customer from your input."
+    else:
+        try:
+            # Nobody reviews webhook orders, so a vague phrase is answered with candidates, not guessed
+            result = parse_order(job.body, customer_key, get_customer_prompt(customer_key), PRODUCT_UNREVIEWED_SCORE)
+            df = parsed_order_to_dataframe(result)
+        except ValueError as e:
+            # The model's answer is unusable; retrying the same message will not help
+            reply = f"Error processing your request: {e}"
+        else:
+            # A re-run of a job that already allocated its order reuses the ID and never inserts twice
+            order_id = job.order_id
+            if order_id is None:
+                order_id = set_job_order_id(job.id, allocate_order_id())
+            df["order_id"] = str(order_id)
+            insert_order_lines_once(order_id, order_lines_from_dataframe(df))
+            reply = f"Order #{order_id} processed successfully! {len(df)} item(s) for {df['supply_date'].iloc[0]}."
+    return reply
+
+
+def process_branches(job, segments, sender_customer):
+    """Save one order per branch named in the message and return the reply."""
+    # Lines before the first named branch are the sender's own order, when the sender is known
+    segments = [segment._replace(customer_id=segment.customer_id or sender_customer) for segment in segments]
+    df, errors = parse_segments(segments, min_score=PRODUCT_UNREVIEWED_SCORE)
+
+    parts = []
+    if not df.empty:
+        # One ID per segment, recorded before inserting, so a re-run reuses them and never inserts twice
+        if job.order_id is not None:
+            order_ids = job.order_id.split(",")
+        else:
+            order_ids = set_job_order_ids(job.id, allocate_order_ids(len(segments)))
+        if len(order_ids) != len(segments):
+            raise RuntimeError(f"Job {job.id} has {len(order_ids)} order IDs for {len(segments)} branches")
+        for index, lines in df.groupby("segment", sort=True):
+            order_id = order_ids[index]
+            lines = lines.drop(columns=["segment"])
+            lines["order_id"] = str(order_id)
+            insert_order_lines_once(order_id, order_lines_from_dataframe(lines))
+            parts.append(
+                f"Order #{order_id} for {lines['customer_name'].iloc[0]}: "
+                f"{len(lines)} item(s) for {lines['supply_date'].iloc[0]}."
+            )
+    parts += [f"Could not process \"{error.text[:40]}\": {error.error}" for error in errors]
+    return "\n".join(parts)
+
+
+def give_up_on_message(job, error):
+    send_reply(job, f"Unexpected error: {error}")
+
+
+def duplicate_reply(job_id):
+    """The answer to a sender who sent the same message again while the first copy is in progress."""
+    status = job_status(job_id)
+    if status is not None and status.status == "done" and status.result:
+        return f"We already processed this message: {status.result}"
+    if status is not None and status.order_id is not None:
+        return f"We already received this message as order #{status.order_id}; it is being processed."
+    return "We already received this message and are still processing it; you will get a confirmation shortly."
+
+
 @app.route('/twilio-webhook', methods=['POST'])
 def twilio_webhook():
     logging.debug(f"Twilio webhook data: {request.form}")
-    print(request.form)  # Works here because it's inside a route.
 
     openai_api_key = os.getenv("OPENAI_API_KEY")
     if not openai_api_key:
         return "OPENAI_API_KEY not set", 500
 
-    openai.api_key = openai_api_key
-
     user_input = request.form.get('Body')  # WhatsApp message content
     from_number = request.form.get('From')  # Sender's phone number
 
     if not user_input:
         return "No input provided", 400
 
-    customer_key = get_customer_from_input(openai, user_input)
-
-    if customer_key == "unknown":
-        resp = MessagingResponse()
-        resp.message("Sorry, we couldn't determine the customer from your input.")
-        return str(resp)
+    # Queue the message and acknowledge at once; a worker replies through the REST API.
+    # Retries and resubmissions of a queued message map to the existing job.
+    job_id, duplicate = enqueue_message_once(
+        user_input, from_number, request.form.get('To'), request.form.get('MessageSid')
+    )
+    response = MessagingResponse()
+    if duplicate is None:
+        logging.debug(f"Queued message from {from_number} as job {job_id}")
+    elif duplicate == "sid":
+        # Twilio redelivered the same message; its job replies once
+        logging.info(f"Twilio retry from {from_number} ignored (job {job_id})")
+    else:
+        # The sender resent the message; tell them where the first copy stands
+        logging.info(f"Resubmission from {from_number} matched job {job_id}")
+        response.message(duplicate_reply(job_id))
+    return str(response)
+
+
+# Background workers that drain the webhook queue
+start_workers(process_message, on_give_up=give_up_on_message)
 
-    try:
-        response = parse_order(openai, customer_key, user_input)
-        resp = MessagingResponse()
-        resp.message(f"Order processed successfully! Updated {response} cells.")
-        return str(resp)
-    except ValueError as e:
-        resp = MessagingResponse()
-        resp.message(f"Error processing your request: {e}")
-        return str(resp)
-    except Exception as e:
-        resp = MessagingResponse()
-        resp.message(f"Unexpected error: {e}")
-        return str(resp)
-    
 if __name__ == '__main__':
     port = int(os.getenv("PORT", 8080))
     app.run(host='0.0.0.0', port=port)